@@ -0,0 +1,159 @@
+# -----------------------------------------------------------------------------
+"""
+
+Memory Transfer Calibration
+
+The debuggers split memory transfers into chunks (the number of values per
+probe command or library call). The best chunk sizes depend on the probe
+model and firmware, so they are measured on the connected probe with
+transfers to/from target ram. The results are saved per probe model and
+firmware and used by the dbgio read/write loops.
+
+"""
+# -----------------------------------------------------------------------------
+
+import os
+import json
+import time
+
+import util
+import iobuf
+import devcache
+
+# -----------------------------------------------------------------------------
+
+help_calibrate = (
+  ('[adr] [len]', 'measure the memory transfer chunk sizes on target ram'),
+  ('  adr', 'ram address (hex) - default 0x20000000'),
+  ('  len', 'length of ram (hex) - default 0x2000'),
+)
+
+# the calibrated chunk sizes are saved here: probe model/firmware -> chunks
+chunk_file = os.path.join(devcache.cache_dir, 'chunks.json')
+
+# default test ram
+RAM_ADR = 0x20000000
+RAM_SIZE = 0x2000
+
+# timed passes over the test ram per chunk size (the fastest is used)
+PASSES = 3
+
+# a chunk size that is a multiple of 16 must be this much slower than the
+# size below it to be avoided
+AVOID16_RATIO = 1.1
+
+# -----------------------------------------------------------------------------
+
+def load_chunks(key):
+  """return the saved chunk sizes for a probe"""
+  try:
+    f = open(chunk_file, 'r')
+    chunks = json.load(f)
+    f.close()
+  except (IOError, ValueError):
+    return {}
+  return chunks.get(key, {})
+
+def save_chunks(key, x):
+  """save the chunk sizes for a probe"""
+  try:
+    f = open(chunk_file, 'r')
+    chunks = json.load(f)
+    f.close()
+  except (IOError, ValueError):
+    chunks = {}
+  chunks[key] = x
+  if not os.path.isdir(os.path.dirname(chunk_file)):
+    os.makedirs(os.path.dirname(chunk_file))
+  f = open(chunk_file, 'w')
+  json.dump(chunks, f, indent=1, sort_keys=True)
+  f.close()
+
+def ram_args(ui, args):
+  """return (adr, size) of the test ram from the command arguments, None on error"""
+  if util.wrong_argc(ui, args, (0, 1, 2)):
+    return None
+  adr = RAM_ADR
+  size = RAM_SIZE
+  if len(args) >= 1:
+    adr = util.int_arg(ui, args[0], (0, 0xffffffff), 16)
+    if adr is None:
+      return None
+  if len(args) == 2:
+    size = util.int_arg(ui, args[1], (0x100, 0x100000), 16)
+    if size is None:
+      return None
+  if adr & 3:
+    ui.put('ram address must be 32-bit aligned\n')
+    return None
+  return (adr, size & ~3)
+
+# -----------------------------------------------------------------------------
+
+def throughput(fn, adr, size, width, n):
+  """return the throughput (bytes/sec) of fn over the test ram with chunks of n values"""
+  t_best = None
+  for i in xrange(PASSES):
+    t_start = time.time()
+    fn(adr, size * 8 / width, n)
+    t = time.time() - t_start
+    t_best = (min(t, t_best), t)[t_best is None]
+  return size / max(t_best, 1e-6)
+
+def measure(ui, test, adr, size):
+  """measure the throughput for the candidate chunk sizes, return (best chunk size, avoid multiples of 16)"""
+  (name, fn, candidates, width, default) = test
+  nmax = size * 8 / width
+  results = {}
+  for n in candidates:
+    if n > nmax:
+      continue
+    results[n] = throughput(fn, adr, size, width, n)
+    ui.put('%-6s %6d: %8.1f KiB/s\n' % (name, n, results[n] / 1024.0))
+  if not results:
+    ui.put('%-6s no chunk size fits the test ram, using %d\n' % (name, default))
+    return (default, False)
+  best = max(results.keys(), key = lambda n: results[n])
+  # larger chunks are not measured, keep a larger default if the largest measured chunk is the best
+  if best == max(results.keys()) and default > nmax:
+    best = default
+  # are multiples of 16 slow?
+  avoid16 = False
+  for n in results.keys():
+    if n & 15 == 0 and results.get(n - 1, 0) > results[n] * AVOID16_RATIO:
+      avoid16 = True
+  return (best, avoid16)
+
+def calibrate(ui, args, dbgio, tests, errors):
+  """
+  measure the chunk sizes on target ram, return the chunk sizes (None on error)
+  tests is a list of (name, fn, candidates, width, default)
+  fn(adr, nvals, n) transfers nvals values starting at adr with chunks of n values
+  errors is a tuple of the exception types raised by the debugger on a transfer error
+  """
+  x = ram_args(ui, args)
+  if x is None:
+    return None
+  (adr, size) = x
+  if not dbgio.is_halted():
+    ui.put('cpu is running - halt it first\n')
+    return None
+  # the test ram is restored afterwards
+  save = iobuf.data_buffer(32)
+  dbgio.rdmem32(adr, size / 4, save)
+  chunks = {}
+  try:
+    for test in tests:
+      (n, avoid16) = measure(ui, test, adr, size)
+      chunks[test[0]] = n
+      chunks['%s_avoid16' % test[0]] = avoid16
+  except errors, e:
+    # a failed transfer makes the timings meaningless, don't save anything
+    ui.put('transfer error: %s\n' % e)
+    ui.put('calibration stopped, the chunk sizes are not changed\n')
+    chunks = None
+  finally:
+    dbgio.wrmem32(adr, size / 4, save)
+  return chunks
+
+# -----------------------------------------------------------------------------
@@ -81,6 +81,48 @@ _system_exceptions = (
   ('SysTick', SysTick_IRQn),
 )
 
+# -----------------------------------------------------------------------------
+# Fault Status
+
+# CFSR = UFSR[31:16] BFSR[15:8] MMFSR[7:0]
+CFSR_MMARVALID = (1 << 7)
+CFSR_BFARVALID = (1 << 15)
+
+# bit, name
+_cfsr_bits = (
+  (0, 'IACCVIOL'),
+  (1, 'DACCVIOL'),
+  (3, 'MUNSTKERR'),
+  (4, 'MSTKERR'),
+  (5, 'MLSPERR'),
+  (7, 'MMARVALID'),
+  (8, 'IBUSERR'),
+  (9, 'PRECISERR'),
+  (10, 'IMPRECISERR'),
+  (11, 'UNSTKERR'),
+  (12, 'STKERR'),
+  (13, 'LSPERR'),
+  (15, 'BFARVALID'),
+  (16, 'UNDEFINSTR'),
+  (17, 'INVSTATE'),
+  (18, 'INVPC'),
+  (19, 'NOCP'),
+  (24, 'UNALIGNED'),
+  (25, 'DIVBYZERO'),
+)
+
+_hfsr_bits = (
+  (1, 'VECTTBL'),
+  (30, 'FORCED'),
+  (31, 'DEBUGEVT'),
+)
+
+def fault_bits(val, bits):
+  """return a string with the names of the set fault status bits"""
+  return ' '.join([name for (bit, name) in bits if val & (1 << bit)])
+
+# -----------------------------------------------------------------------------
+
 def add_system_exceptions(device):
   """Add the system exceptions to the interrupt dictionary"""
   for (name, irq) in _system_exceptions:
@@ -116,6 +158,7 @@ class cortexm(object):
 
     self.menu = (
       ('cpuid', self.cmd_cpuid),
+      ('faults', self.cmd_faults),
       ('rate', self.cmd_systick_rate),
       ('test', self.cmd_test),
     )
@@ -262,7 +305,7 @@ class cortexm(object):
   def cmd_regs(self, ui, args):
     """display cpu registers"""
     self.halt()
-    regs = [self.dbgio.rdreg(name) for name in regnames]
+    regs = self.dbgio.rdregs(regnames)
     if len(self.saved_regs) == 0:
       self.saved_regs = regs
     delta = [('*', '')[x == y] for (x, y) in zip(self.saved_regs, regs)]
@@ -363,6 +406,27 @@ class cortexm(object):
     """display cpu identifier"""
     ui.put('%s\n' % self.device.SCB.display('CPUID', fields = True))
 
+  def cmd_faults(self, ui, args):
+    """display fault status and fault addresses"""
+    scb = self.device.SCB
+    if not scb.registers.has_key('CFSR'):
+      ui.put('no fault status registers for this cpu\n')
+      return
+    amap = self.device.address_map()
+    cfsr = scb.CFSR.rd()
+    hfsr = scb.HFSR.rd()
+    clist = []
+    clist.append(['CFSR', ': %08x' % cfsr, fault_bits(cfsr, _cfsr_bits)])
+    clist.append(['HFSR', ': %08x' % hfsr, fault_bits(hfsr, _hfsr_bits)])
+    # the fault address registers are only meaningful when flagged as valid
+    if cfsr & CFSR_MMARVALID:
+      adr = scb.MMFAR.rd()
+      clist.append(['MMFAR', ': %08x' % adr, amap.name(adr) or ''])
+    if cfsr & CFSR_BFARVALID:
+      adr = scb.BFAR.rd()
+      clist.append(['BFAR', ': %08x' % adr, amap.name(adr) or ''])
+    ui.put('%s\n' % util.display_cols(clist))
+
   def cmd_vtable(self, ui, args):
     """display exceptions vector table"""
     s = []
@@ -0,0 +1,182 @@
+# -----------------------------------------------------------------------------
+"""
+
+Compiled Device Cache
+
+Building a device from an SVD file (gunzip, parse, build, fixup) is slow for
+the larger SoCs. The fully built device is pickled to disk and re-used on the
+next run. The cache key covers everything that goes into the build:
+
+* the contents of the SVD file
+* the SoC name
+* the source code of the SVD converter and the fixup functions
+
+Any change to these will produce a new key, so stale devices are never loaded.
+
+"""
+# -----------------------------------------------------------------------------
+
+import gc
+import os
+import sys
+import time
+import errno
+import hashlib
+import cPickle as pickle
+
+import startup
+
+# -----------------------------------------------------------------------------
+
+# bump this to invalidate all cached devices
+_cache_version = 1
+
+# cache modes:
+# 'on' - load from the cache, build and save on a miss
+# 'rebuild' - always build, save the result
+# 'off' - always build, don't touch the cache
+mode = 'on'
+
+# cached devices are stored here
+cache_dir = './cache'
+
+# -----------------------------------------------------------------------------
+
+def file_hash(path):
+  """return the sha1 hex digest of a file"""
+  h = hashlib.sha1()
+  f = open(path, 'rb')
+  h.update(f.read())
+  f.close()
+  return h.hexdigest()
+
+def module_source(name):
+  """return the source file path for a loaded module"""
+  path = sys.modules[name].__file__
+  return '%s.py' % os.path.splitext(path)[0]
+
+def fixup_version(fixups):
+  """return a version string for the code used to build and fixup a device"""
+  # the converter and the cortex-m peripherals used by most fixups
+  modules = ['soc', 'svd', 'cmregs']
+  for f in fixups:
+    if f.__module__ not in modules:
+      modules.append(f.__module__)
+  h = hashlib.sha1()
+  for name in modules:
+    if sys.modules.has_key(name):
+      h.update(file_hash(module_source(name)))
+  return h.hexdigest()
+
+def cache_key(name, svd_file, fixups):
+  """return the cache key for a device"""
+  h = hashlib.sha1()
+  h.update('%d' % _cache_version)
+  h.update(name)
+  h.update(file_hash(svd_file))
+  h.update(fixup_version(fixups))
+  return h.hexdigest()
+
+def cache_path(name, key):
+  """return the path of the cache file for a device"""
+  return os.path.join(cache_dir, '%s-%s.pkl' % (name, key[:16]))
+
+# -----------------------------------------------------------------------------
+
+def load(path):
+  """load a device from the cache, return None on a miss"""
+  if not os.path.isfile(path):
+    return None
+  # the device is a large number of small objects, and the cyclic garbage
+  # collector would otherwise run many times during the load.
+  gc_enabled = gc.isenabled()
+  gc.disable()
+  try:
+    f = open(path, 'rb')
+    device = pickle.load(f)
+    f.close()
+  except Exception:
+    # a corrupted or incompatible cache file is just a miss
+    device = None
+  if gc_enabled:
+    gc.enable()
+  return device
+
+def save(path, device):
+  """save a device to the cache"""
+  # build any stub peripherals, the cache holds the complete device
+  device.materialize()
+  try:
+    os.makedirs(cache_dir)
+  except OSError, e:
+    # it exists, or a parallel build (tools/svdbuild -p) has just made it
+    if e.errno != errno.EEXIST:
+      raise
+  # write to a temporary file and rename, so a partial file is never loaded
+  tmp = '%s.tmp%d' % (path, os.getpid())
+  f = open(tmp, 'wb')
+  pickle.dump(device, f, pickle.HIGHEST_PROTOCOL)
+  f.close()
+  os.rename(tmp, path)
+
+def build(info, svd_file, lazy=False):
+  """build the device from the svd file and run the fixups"""
+  # the svd converter is only imported when a device is built
+  import soc
+  startup.start('svd compile')
+  try:
+    if lazy:
+      # the peripheral registers are built on first use
+      device = soc.build_device(svd_file, lazy=True)
+    else:
+      device = soc.build_device(svd_file, stream=True)
+  finally:
+    startup.stop()
+  startup.start('fixups')
+  try:
+    for f in info.fixups:
+      f(device)
+  finally:
+    startup.stop()
+  return device
+
+# -----------------------------------------------------------------------------
+
+def get_device(ui, info, svd_file):
+  """return the device structure for an SoC, using the cache if possible"""
+  if mode == 'off':
+    ui.put('%s: compiling %s\n' % (info.name, svd_file))
+    t_start = time.time()
+    device = build(info, svd_file, lazy=True)
+    ui.put('%s: compiled in %.2f s (cache disabled)\n' % (info.name, time.time() - t_start))
+    return device
+
+  t_start = time.time()
+  startup.start('cache key')
+  try:
+    path = cache_path(info.name, cache_key(info.name, svd_file, info.fixups))
+  finally:
+    startup.stop()
+  if mode == 'on':
+    startup.start('cache load')
+    try:
+      device = load(path)
+    finally:
+      startup.stop()
+    if device is not None:
+      ui.put('%s: cache hit %s (%.1f ms)\n' % (info.name, path, (time.time() - t_start) * 1000.0))
+      return device
+
+  # cache miss (or forced rebuild)
+  ui.put('%s: compiling %s\n' % (info.name, svd_file))
+  device = build(info, svd_file)
+  t_build = time.time() - t_start
+  startup.start('cache save')
+  try:
+    save(path, device)
+  finally:
+    startup.stop()
+  ui.put('%s: cache %s, compiled in %.2f s\n' % (info.name, ('miss', 'rebuild')[mode == 'rebuild'], t_build))
+  return device
+
+# -----------------------------------------------------------------------------
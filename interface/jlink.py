@@ -11,13 +11,20 @@ Notes:
 
 1) Tested with J-Link Base/EDU, J-Link EDU == J-Link Base (so far as I can tell)
 
+2) SWD transactions are queued and sent as EMU_CMD_HW_JTAG3 bit streams.
+Many transactions are sent in each usb transfer. In SWD mode the TMS stream
+sets the SWDIO direction (1 = probe drives) and TDI/TDO are the out/in data.
+This is a debugger interface that does not need the J-Link library.
+
 """
 #------------------------------------------------------------------------------
 
 import struct
 from array import array as Array
-from usbtools.usbtools import UsbTools
 import usbdev
+import cortexm
+import startup
+import swd as swdp
 
 #------------------------------------------------------------------------------
 
@@ -25,6 +32,9 @@ _MHz = 1000000.0
 _KHz = 1000.0
 _FREQ = 12.0 * _MHz
 
+class JLinkError(IOError):
+  pass
+
 #------------------------------------------------------------------------------
 # supported devices
 
@@ -231,7 +241,13 @@ class jlink(object):
     self.hw_jtag_cmd = (EMU_CMD_HW_JTAG2, EMU_CMD_HW_JTAG3)[ver['major'] >= 5]
 
   def __del__(self):
-    self.usb.close()
+    self.close()
+
+  def close(self):
+    """close the usb device"""
+    if self.usb is not None:
+      self.usb.close()
+      self.usb = None
 
   def get_version(self):
     """Return the firmware version"""
@@ -342,6 +358,21 @@ class jlink(object):
     self.usb.write_data(Array('B', cmd))
     return struct.unpack('<I', self.usb.read_data(4))[0]
 
+  def hw_jtag(self, n, tms, tdi):
+    """clock n bits of tms/tdi (byte strings, lsb first), return the tdo byte string"""
+    cmd = Array('B', (self.hw_jtag_cmd, 0, n & 0xff, (n >> 8) & 0xff))
+    cmd.fromstring(tms)
+    cmd.fromstring(tdi)
+    self.usb.write_data(cmd)
+    nbytes = (n + 7) >> 3
+    if self.hw_jtag_cmd == EMU_CMD_HW_JTAG3:
+      # tdo bytes + status byte
+      rd = self.usb.read_data(nbytes + 1)
+      if rd[-1] != 0:
+        raise JLinkError("EMU_CMD_HW_JTAG3 error %d" % rd[-1])
+      return rd[:-1].tostring()
+    return self.usb.read_data(nbytes).tostring()
+
   def details_str(self):
     """return a string for device details"""
     s = ['%s' % x for x in self.get_version()]
@@ -363,18 +394,347 @@ class jlink(object):
     return 'Segger J-Link usb %04x:%04x serial %r' % (self.vid, self.pid, self.sn)
 
 #------------------------------------------------------------------------------
+# SWD transactions as HW_JTAG3 bit streams
+
+# the maximum bits in a HW_JTAG3 command (as openocd jlink.c)
+MAX_BITS = 2048 * 8
+
+# a transaction is an 8-bit request driven by the probe, then
+# read: turnaround, ack(3), data(32), parity, turnaround from the target
+# write: turnaround, ack(3), turnaround from the target, data(32), parity driven by the probe
+_XFER_BITS = 8 + 1 + 3 + 32 + 1 + 1
+_RD_TMS = 0xff
+_WR_TMS = 0xff | (((1 << 33) - 1) << 13)
+_WR_DATA = 13
+
+# transactions as binary strings (msb first)
+_XFER_FMT = '0%db' % _XFER_BITS
+_RD_TMS_STR = format(_RD_TMS, _XFER_FMT)
+_WR_TMS_STR = format(_WR_TMS, _XFER_FMT)
+_RD_TDI_STR = [format(req, _XFER_FMT) for req in xrange(256)]
+
+# offsets in the tdo stream (J-Link samples the turnaround before the ack)
+_ACK_OFS = 8
+_DATA_OFS = 8 + 3
+_PARITY_OFS = 8 + 3 + 32
+
+# idle cycles after AP accesses (doubled after a WAIT response, halved after a run without one)
+AP_DELAY = 8
+MAX_AP_DELAY = 64
+
+# a transaction group is retried this many times after WAIT responses
+RETRIES = 8
+
+# values per memory transfer group (a group is retried as a whole)
+GROUP_VALS = 128
+
+# polls of CTRL/STAT for the debug power up acknowledge
+PWRUP_POLLS = 100
+
+_CSW_SIZE = {8: swdp.CSW_SIZE8, 16: swdp.CSW_SIZE16, 32: swdp.CSW_SIZE32}
+
+# queued DRW transactions
+_DRW_RD = (swdp.request(1, 1, swdp.AP_DRW), None)
+_DRW_WR = swdp.request(1, 0, swdp.AP_DRW)
+
+def _to_bytes(x, n):
+  """return an n-bit integer as a byte string (lsb first)"""
+  nbytes = (n + 7) >> 3
+  return ('%x' % x).zfill(nbytes * 2).decode('hex')[::-1]
+
+def _from_bytes(s):
+  """return a byte string (lsb first) as an integer"""
+  return int(s[::-1].encode('hex'), 16)
 
 class swd(object):
+  """SWD transactions on a J-Link
 
-  def __init__(self, dev):
+  Transactions are queued in groups. run() sends the queued groups with as
+  many groups per usb transfer as fit in a HW_JTAG3 command. A group that
+  gets a WAIT response is retried from its start (after a line reset), so
+  a group must be safe to repeat.
+  """
+
+  def __init__(self, dev, khz = None):
     self.jlink = jlink(dev)
     state = self.jlink.get_state()
     # check VREF
     assert state['vref'] > 1500, 'Vref is too low. Check target power.'
+    assert self.jlink.hw_jtag_cmd == EMU_CMD_HW_JTAG3, 'swd needs EMU_CMD_HW_JTAG3 (hardware v5 or later)'
     # select interface SWD
     self.jlink.select_interface(TIF_SWD)
     # set the swd clock frequency
-    self.jlink.set_frequency(_FREQ)
+    if khz is None:
+      self.jlink.set_frequency(_FREQ)
+    else:
+      self.jlink.set_frequency(khz * _KHz)
+    self.ap_delay = AP_DELAY
+    # cached DP SELECT and AP CSW values (None = unknown)
+    self.select = None
+    self.csw = None
+    # queued groups of (request, write value) transactions (None for reads)
+    self.groups = []
+    self.group = []
+
+  def close(self):
+    """close the usb device"""
+    self.jlink.close()
+
+  def connect(self):
+    """switch the SWJ-DP to SWD, power up the debug port, return the idcode"""
+    self.select = None
+    self.csw = None
+    self.ap_delay = AP_DELAY
+    group = [
+      (swdp.request(0, 1, swdp.DP_IDCODE), None),
+      (swdp.request(0, 0, swdp.DP_ABORT), swdp.ABORT_CLEAR),
+      (swdp.request(0, 0, swdp.DP_SELECT), 0),
+      (swdp.request(0, 0, swdp.DP_CTRL_STAT), swdp.CSYSPWRUPREQ | swdp.CDBGPWRUPREQ),
+    ]
+    (vals, k, ack) = self.xfer([group], swdp.jtag2swd)
+    if k == 0:
+      raise JLinkError('swd connect: no response from the target (ack %d)' % ack)
+    idcode = vals[0][0]
+    self.select = 0
+    ack = swdp.CSYSPWRUPACK | swdp.CDBGPWRUPACK
+    for i in xrange(PWRUP_POLLS):
+      self.rd_dp(swdp.DP_CTRL_STAT)
+      if self.run()[0][0] & ack == ack:
+        return idcode
+    raise JLinkError('swd connect: debug power up not acknowledged')
+
+  def recover(self):
+    """line reset and clear the sticky errors (the SELECT and CSW values are kept)"""
+    group = [
+      (swdp.request(0, 1, swdp.DP_IDCODE), None),
+      (swdp.request(0, 0, swdp.DP_ABORT), swdp.ABORT_CLEAR),
+    ]
+    self.xfer([group], swdp.line_reset)
+
+  # queue transactions
+
+  def rd_dp(self, reg):
+    """queue a DP register read"""
+    self.group.append((swdp.request(0, 1, reg), None))
+
+  def wr_dp(self, reg, val):
+    """queue a DP register write"""
+    self.group.append((swdp.request(0, 0, reg), val))
+
+  def ap_select(self, reg):
+    """queue a DP SELECT write for the AP register bank (if needed)"""
+    bank = reg & 0xf0
+    if bank != self.select:
+      self.wr_dp(swdp.DP_SELECT, bank)
+      self.select = bank
+
+  def rd_ap(self, reg):
+    """queue an AP register read (the value is returned by the next AP or RDBUFF read)"""
+    self.ap_select(reg)
+    self.group.append((swdp.request(1, 1, reg), None))
+
+  def wr_ap(self, reg, val):
+    """queue an AP register write"""
+    self.ap_select(reg)
+    self.group.append((swdp.request(1, 0, reg), val))
+
+  def end_group(self):
+    """end the current transaction group"""
+    if self.group:
+      self.groups.append(self.group)
+      self.group = []
+
+  # run transactions
+
+  def stream(self, groups, prefix):
+    """return (nbits, tms, tdi, transactions) for the groups, transactions = [(group, position, read)]"""
+    # the streams are built as lists of binary strings (msb first) and
+    # converted once, or'ing each transaction into a long integer is slow
+    tms = []
+    tdi = []
+    pos = 0
+    if prefix is not None:
+      pos = prefix.n
+      tms.append('1' * pos)
+      tdi.append(format(prefix.val, '0%db' % pos))
+    idle_tms = '1' * self.ap_delay
+    idle_tdi = '0' * self.ap_delay
+    xfers = []
+    for (k, group) in enumerate(groups):
+      for (req, val) in group:
+        if val is None:
+          tms.append(_RD_TMS_STR)
+          tdi.append(_RD_TDI_STR[req])
+        else:
+          tms.append(_WR_TMS_STR)
+          tdi.append(format(req | ((val | (swdp.parity32(val) << 32)) << _WR_DATA), _XFER_FMT))
+        xfers.append((k, pos, val is None))
+        pos += _XFER_BITS
+        if req & 2:
+          # idle cycles after an AP access
+          tms.append(idle_tms)
+          tdi.append(idle_tdi)
+          pos += self.ap_delay
+    # at least 8 idle cycles to clock the last transaction through the AP
+    idle = 8
+    # avoid a usb reply that is a multiple of 64 bytes
+    while (((pos + idle + 7) >> 3) + 1) % 64 == 0:
+      idle += 8
+    tms.append('1' * idle)
+    tdi.append('0' * idle)
+    pos += idle
+    tms.reverse()
+    tdi.reverse()
+    return (pos, int(''.join(tms), 2), int(''.join(tdi), 2), xfers)
+
+  def stream_bits(self, group):
+    """return the number of bits for a group (without the trailing idle cycles)"""
+    n = len(group) * _XFER_BITS
+    n += len([req for (req, val) in group if req & 2]) * self.ap_delay
+    return n
+
+  def xfer(self, groups, prefix = None):
+    """
+    send the groups in one usb transfer
+    return (read values per completed group, number of completed groups, ack of the failed transaction)
+    """
+    (n, tms, tdi, xfers) = self.stream(groups, prefix)
+    assert n <= MAX_BITS, 'HW_JTAG3 stream too long'
+    tdo = _from_bytes(self.jlink.hw_jtag(n, _to_bytes(tms, n), _to_bytes(tdi, n)))
+    vals = [[] for group in groups]
+    for (k, pos, rd) in xfers:
+      ack = (tdo >> (pos + _ACK_OFS)) & 7
+      if ack != swdp.ACK_OK:
+        return (vals[:k], k, ack)
+      if rd:
+        x = (tdo >> (pos + _DATA_OFS)) & 0xffffffff
+        if swdp.parity32(x) != (tdo >> (pos + _PARITY_OFS)) & 1:
+          self.recover()
+          self.select = None
+          self.csw = None
+          raise JLinkError('swd read parity error')
+        vals[k].append(int(x))
+    return (vals, len(groups), swdp.ACK_OK)
+
+  def run(self):
+    """run the queued transactions, return the read values per group"""
+    self.end_group()
+    groups = self.groups
+    self.groups = []
+    vals = []
+    retries = 0
+    waits = 0
+    i = 0
+    try:
+      while i < len(groups):
+        # as many groups as fit in a usb transfer (reserve bits for the trailing idle cycles)
+        j = i
+        nbits = 64 * 8
+        while j < len(groups):
+          nbits += self.stream_bits(groups[j])
+          if j > i and nbits > MAX_BITS:
+            break
+          j += 1
+        (x, k, ack) = self.xfer(groups[i:j])
+        vals.extend(x)
+        i += k
+        if k:
+          retries = 0
+        if ack == swdp.ACK_OK:
+          continue
+        # line reset, the failed group is redone from its start
+        self.recover()
+        if ack == swdp.ACK_WAIT and retries < RETRIES:
+          retries += 1
+          waits += 1
+          self.ap_delay = min(self.ap_delay * 2, MAX_AP_DELAY)
+          continue
+        raise JLinkError('swd transaction failed (ack %d)' % ack)
+    except:
+      # after a failed or interrupted transfer the SELECT and CSW writes are unknown
+      self.select = None
+      self.csw = None
+      raise
+    if waits == 0:
+      # no WAIT responses, decay the idle cycles back towards the default
+      self.ap_delay = max(self.ap_delay / 2, AP_DELAY)
+    return vals
+
+  # memory access through the MEM-AP
+
+  def set_csw(self, width):
+    """queue a CSW write for the access width (if needed)"""
+    csw = swdp.CSW_DEFAULT | _CSW_SIZE[width]
+    if csw != self.csw:
+      self.wr_ap(swdp.AP_CSW, csw)
+      self.csw = csw
+
+  def mem_groups(self, adr, n, width):
+    """return the (adr, n) groups for n values: at most GROUP_VALS within a TAR auto-increment block"""
+    nbytes = width >> 3
+    groups = []
+    while n > 0:
+      nx = min(n, GROUP_VALS, (swdp.TAR_BLOCK - (adr & (swdp.TAR_BLOCK - 1))) / nbytes)
+      groups.append((adr, nx))
+      n -= nx
+      adr += nx * nbytes
+    return groups
+
+  def q_rd_mem(self, adr, n, width):
+    """queue a read of n values from memory, return the (adr, n) groups"""
+    groups = self.mem_groups(adr, n, width)
+    for (adr, n) in groups:
+      self.set_csw(width)
+      self.wr_ap(swdp.AP_TAR, adr)
+      # a DRW read returns the previous value, RDBUFF returns the last value
+      self.rd_ap(swdp.AP_DRW)
+      self.group.extend([_DRW_RD] * (n - 1))
+      self.rd_dp(swdp.DP_RDBUFF)
+      self.end_group()
+    return groups
+
+  def q_wr_mem(self, adr, vals, width):
+    """queue a write of the values to memory"""
+    nbytes = width >> 3
+    mask = (1 << width) - 1
+    i = 0
+    for (adr, n) in self.mem_groups(adr, len(vals), width):
+      self.set_csw(width)
+      self.wr_ap(swdp.AP_TAR, adr)
+      # DRW is in the same bank as TAR
+      if width == 32:
+        self.group.extend([(_DRW_WR, x) for x in vals[i:i + n]])
+      else:
+        # 8/16-bit values are on the byte lanes of their address
+        self.group.extend([(_DRW_WR, (vals[i + j] & mask) << (((adr + j * nbytes) & 3) << 3)) for j in xrange(n)])
+      # RDBUFF completes the last write
+      self.rd_dp(swdp.DP_RDBUFF)
+      self.end_group()
+      i += n
+
+  def mem_vals(self, groups, vals, width):
+    """return the memory values from the read values of the q_rd_mem groups"""
+    x = []
+    if width == 32:
+      for v in vals:
+        x.extend(v[1:])
+      return x
+    nbytes = width >> 3
+    mask = (1 << width) - 1
+    for ((adr, n), v) in zip(groups, vals):
+      for j in xrange(n):
+        x.append((v[j + 1] >> (((adr + j * nbytes) & 3) << 3)) & mask)
+    return x
+
+  def rd_mem(self, adr, n, width):
+    """read n values (8/16/32-bit) from memory starting at adr"""
+    groups = self.q_rd_mem(adr, n, width)
+    return self.mem_vals(groups, self.run(), width)
+
+  def wr_mem(self, adr, vals, width):
+    """write values (8/16/32-bit) to memory starting at adr"""
+    self.q_wr_mem(adr, vals, width)
+    self.run()
 
   def __str__(self):
     s = []
@@ -382,6 +742,267 @@ class swd(object):
     s.append(str(self.jlink))
     return '\n'.join(s)
 
+#------------------------------------------------------------------------------
+# map register names to DCRSR register numbers
+
+regmap = {
+  'r0':0, 'r1':1, 'r2':2, 'r3':3, 'r4':4, 'r5':5, 'r6':6, 'r7':7,
+  'r8':8, 'r9':9, 'r10':10, 'r11':11, 'r12':12, 'r13':13, 'r14':14, 'r15':15,
+  'lr':14, 'pc':15, 'psr':16, 'msp':17, 'psp':18,
+  # 19 reserved
+  # 20 control/faultmask/basepri/primask
+}
+
+# the special registers are packed into register 20: name: bit shift
+SPECIAL_REG = 20
+special_regs = {'primask':0, 'basepri':8, 'faultmask':16, 'control':24}
+
+# DCRSR register write
+DCRSR_REGWNR = (1 << 16)
+
+# polls of DHCSR for S_REGRDY
+REGRDY_POLLS = 100
+
+# system reset request
+AIRCR = 0xE000ED0C
+AIRCR_SYSRESETREQ = 0x05FA0004
+
+# values per memory transfer run (bounds the buffered values)
+RUN_VALS = 0x1000
+
+#------------------------------------------------------------------------------
+
+class dbgio(object):
+  """J-Link (usb protocol, no library) implementation of dbgio cpu interface"""
+
+  def __init__(self, vid=None, pid=None, sn=None, max_khz=None):
+    """no actual operations, record the selected usb device"""
+    self.vid = vid
+    self.pid = pid
+    self.sn = sn
+    self.max_khz = max_khz
+    self.cpu_name = None
+    self.itf = None
+    self.idcode = None
+    self.menu = (
+      ('info', self.cmd_info),
+    )
+
+  def connect(self, cpu_name, itf):
+    """connect the debugger to the target"""
+    assert itf == 'swd', 'the jlink usb driver only supports swd'
+    self.cpu_name = cpu_name
+    self.itf = itf
+    startup.start('probe init')
+    try:
+      self.swd = swd((self.vid, self.pid, self.sn), self.max_khz)
+    finally:
+      startup.stop()
+    self.idcode = self.swd.connect()
+
+  def disconnect(self):
+    """disconnect the debugger from the target"""
+    self.swd.close()
+
+  def target_voltage(self):
+    """return the target voltage in mV"""
+    return self.swd.jlink.get_state()['vref']
+
+  def cmd_info(self, ui, args):
+    """display jlink information"""
+    ui.put('%s\n' % self)
+
+  def is_halted(self):
+    """return True if target is halted"""
+    return self.rd32(cortexm.DCB_DHCSR) & cortexm.S_HALT != 0
+
+  def is_running(self):
+    """return True if target is running"""
+    return not self.is_halted()
+
+  def halt(self):
+    """halt the cpu"""
+    self.wr32(cortexm.DCB_DHCSR, cortexm.DBGKEY | cortexm.C_DEBUGEN | cortexm.C_HALT)
+
+  def go(self):
+    """put the cpu into running mode"""
+    self.wr32(cortexm.DCB_DHCSR, cortexm.DBGKEY | cortexm.C_DEBUGEN)
+
+  def step(self):
+    """single step the cpu"""
+    self.wr32(cortexm.DCB_DHCSR, cortexm.DBGKEY | cortexm.C_DEBUGEN | cortexm.C_STEP)
+
+  def reset(self):
+    """reset the target (system reset request)"""
+    try:
+      self.wr32(AIRCR, AIRCR_SYSRESETREQ)
+    except (JLinkError, usbdev.usbdev_error):
+      # the reset can interrupt the write response
+      pass
+    self.swd.connect()
+
+  def rd_core_regs(self, nums):
+    """read core registers (DCRSR numbers), return a list of values"""
+    for n in nums:
+      self.swd.q_wr_mem(cortexm.DCB_DCRSR, (n,), 32)
+      self.swd.q_rd_mem(cortexm.DCB_DHCSR, 1, 32)
+      self.swd.q_rd_mem(cortexm.DCB_DCRDR, 1, 32)
+    vals = self.swd.run()
+    l = []
+    for (i, n) in enumerate(nums):
+      # groups: DCRSR write, DHCSR read, DCRDR read
+      (dhcsr, x) = (vals[3 * i + 1][1], vals[3 * i + 2][1])
+      if not dhcsr & cortexm.S_REGRDY:
+        # the register transfer was slow, poll and read it again
+        self.regrdy_poll()
+        x = self.rd32(cortexm.DCB_DCRDR)
+      l.append(x)
+    return l
+
+  def regrdy_poll(self):
+    """poll DHCSR for the completion of a core register transfer"""
+    for i in xrange(REGRDY_POLLS):
+      if self.rd32(cortexm.DCB_DHCSR) & cortexm.S_REGRDY:
+        return
+    raise JLinkError('core register transfer timeout (is the cpu halted?)')
+
+  def wr_core_reg(self, n, val):
+    """write a core register (DCRSR number)"""
+    self.swd.q_wr_mem(cortexm.DCB_DCRDR, (val,), 32)
+    self.swd.q_wr_mem(cortexm.DCB_DCRSR, (n | DCRSR_REGWNR,), 32)
+    self.swd.q_rd_mem(cortexm.DCB_DHCSR, 1, 32)
+    if not self.swd.run()[-1][1] & cortexm.S_REGRDY:
+      self.regrdy_poll()
+
+  def rdreg(self, reg):
+    """read from the named register"""
+    if special_regs.has_key(reg):
+      return (self.rd_core_regs((SPECIAL_REG,))[0] >> special_regs[reg]) & 0xff
+    n = regmap.get(reg, None)
+    if n is None:
+      return None
+    return self.rd_core_regs((n,))[0]
+
+  def rdregs(self, regs):
+    """read a list of named registers, return a list of values (None if unknown)"""
+    nums = sorted(set([regmap.get(reg, (None, SPECIAL_REG)[special_regs.has_key(reg)]) for reg in regs]) - set((None,)))
+    vals = dict(zip(nums, self.rd_core_regs(nums)))
+    l = []
+    for reg in regs:
+      if special_regs.has_key(reg):
+        l.append((vals[SPECIAL_REG] >> special_regs[reg]) & 0xff)
+      elif regmap.has_key(reg):
+        l.append(vals[regmap[reg]])
+      else:
+        l.append(None)
+    return l
+
+  def wrreg(self, reg, val):
+    """write to the named register"""
+    if special_regs.has_key(reg):
+      # read-modify-write the packed special registers
+      shift = special_regs[reg]
+      x = self.rd_core_regs((SPECIAL_REG,))[0] & ~(0xff << shift)
+      self.wr_core_reg(SPECIAL_REG, x | ((val & 0xff) << shift))
+      return
+    n = regmap.get(reg, None)
+    if n is None:
+      return
+    self.wr_core_reg(n, val)
+
+  def rd_vals(self, adr, n, width, wr):
+    """read n values from memory starting at adr, write them to wr()"""
+    nbytes = width >> 3
+    while n > 0:
+      nread = min(n, RUN_VALS)
+      [wr(x) for x in self.swd.rd_mem(adr, nread, width)]
+      n -= nread
+      adr += nread * nbytes
+
+  def wr_vals(self, adr, n, width, rd):
+    """write n values from rd() to memory starting at adr"""
+    nbytes = width >> 3
+    while n > 0:
+      nwrite = min(n, RUN_VALS)
+      self.swd.wr_mem(adr, [rd() for i in xrange(nwrite)], width)
+      n -= nwrite
+      adr += nwrite * nbytes
+
+  def rdmem32(self, adr, n, io):
+    """read n 32-bit words from memory starting at adr"""
+    self.rd_vals(adr, n, 32, io.wr32)
+
+  def rdmem16(self, adr, n, io):
+    """read n 16-bit words from memory starting at adr"""
+    self.rd_vals(adr, n, 16, io.wr16)
+
+  def rdmem8(self, adr, n, io):
+    """read n 8-bit words from memory starting at adr"""
+    self.rd_vals(adr, n, 8, io.wr8)
+
+  def rdmem(self, adr, n, io):
+    """read a buffer from memory starting at adr"""
+    if io.has_wr(32):
+      self.rdmem32(adr, n, io)
+    elif io.has_wr(16):
+      self.rdmem16(adr, n, io)
+    elif io.has_wr(8):
+      self.rdmem8(adr, n, io)
+    else:
+      assert False, 'bad buffer width'
+
+  def wrmem32(self, adr, n, io):
+    """write n 32-bit words to memory starting at adr"""
+    self.wr_vals(adr, n, 32, io.rd32)
+
+  def wrmem16(self, adr, n, io):
+    """write n 16-bit words to memory starting at adr"""
+    self.wr_vals(adr, n, 16, io.rd16)
+
+  def wrmem8(self, adr, n, io):
+    """write n 8-bit words to memory starting at adr"""
+    self.wr_vals(adr, n, 8, io.rd8)
+
+  def wrmem(self, adr, n, io):
+    """write a buffer to memory starting at adr"""
+    if io.has_rd(32):
+      self.wrmem32(adr, n, io)
+    elif io.has_rd(16):
+      self.wrmem16(adr, n, io)
+    elif io.has_rd(8):
+      self.wrmem8(adr, n, io)
+    else:
+      assert False, 'bad buffer width'
+
+  def rd32(self, adr):
+    """read 32 bit value from adr"""
+    return self.swd.rd_mem(adr, 1, 32)[0]
+
+  def rd16(self, adr):
+    """read 16 bit value from adr"""
+    return self.swd.rd_mem(adr, 1, 16)[0]
+
+  def rd8(self, adr):
+    """read 8 bit value from adr"""
+    return self.swd.rd_mem(adr, 1, 8)[0]
+
+  def wr32(self, adr, val):
+    """write 32 bit value to adr"""
+    self.swd.wr_mem(adr, (val,), 32)
+
+  def wr16(self, adr, val):
+    """write 16 bit value to adr"""
+    self.swd.wr_mem(adr, (val,), 16)
+
+  def wr8(self, adr, val):
+    """write 8 bit value to adr"""
+    self.swd.wr_mem(adr, (val,), 8)
+
+  def __str__(self):
+    s = [str(self.swd)]
+    s.append('jlink: swd idcode 0x%08x' % self.idcode)
+    return '\n'.join(s)
+
 #------------------------------------------------------------------------------
 
 class jtag(object):
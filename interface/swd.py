@@ -55,3 +55,65 @@ dormant2swd.append(_reset)
 dormant2swd.append(bits(1,(0,)))
 
 #------------------------------------------------------------------------------
+# SWD packet request: start(1) APnDP RnW A[2:3] parity stop(0) park(1)
+# (transmitted lsb first)
+
+def request(ap, rd, reg):
+  """return the packet request byte for an access to register address reg (A[3:2])"""
+  x = (ap << 1) | (rd << 2) | ((reg & 0xc) << 1)
+  parity = bin(x).count('1') & 1
+  return 0x81 | x | (parity << 5)
+
+def parity32(x):
+  """return the parity of a 32-bit value"""
+  return bin(x).count('1') & 1
+
+# acknowledge responses
+ACK_OK = 1
+ACK_WAIT = 2
+ACK_FAULT = 4
+
+#------------------------------------------------------------------------------
+# Debug Port Registers
+
+DP_IDCODE = 0x0 # read
+DP_ABORT = 0x0 # write
+DP_CTRL_STAT = 0x4
+DP_SELECT = 0x8
+DP_RDBUFF = 0xc
+
+# ABORT register
+ABORT_ORUNERRCLR = (1 << 4)
+ABORT_WDERRCLR = (1 << 3)
+ABORT_STKERRCLR = (1 << 2)
+ABORT_STKCMPCLR = (1 << 1)
+ABORT_DAPABORT = (1 << 0)
+ABORT_CLEAR = ABORT_ORUNERRCLR | ABORT_WDERRCLR | ABORT_STKERRCLR | ABORT_STKCMPCLR
+
+# CTRL/STAT register
+CSYSPWRUPACK = (1 << 31)
+CSYSPWRUPREQ = (1 << 30)
+CDBGPWRUPACK = (1 << 29)
+CDBGPWRUPREQ = (1 << 28)
+STICKYERR = (1 << 5)
+
+#------------------------------------------------------------------------------
+# MEM-AP Registers (the select bank is in bits [7:4])
+
+AP_CSW = 0x00
+AP_TAR = 0x04
+AP_DRW = 0x0c
+AP_IDR = 0xfc
+
+# CSW register
+CSW_SIZE8 = 0
+CSW_SIZE16 = 1
+CSW_SIZE32 = 2
+CSW_SADDRINC = (1 << 4)
+# master type debug, hprot privileged, reserved bit 24, dbgstatus
+CSW_DEFAULT = 0x23000040 | CSW_SADDRINC
+
+# the TAR auto-increment is only guaranteed within a 1 KiB block
+TAR_BLOCK = 1 << 10
+
+#------------------------------------------------------------------------------
@@ -7,6 +7,10 @@ import struct
 
 from ctypes import c_uint32, c_int, c_void_p
 
+import iobuf
+import startup
+import calibrate
+
 # ----------------------------------------------------------------------------
 # target interface
 
@@ -108,6 +112,93 @@ def get_jlink_dll():
     jlink, backend_info = locate_library('libjlinkarm.so.5.dylib', search_path, ctypes.cdll)
   return jlink, backend_info
 
+# ----------------------------------------------------------------------------
+# dll function prototypes (name, restype, argtypes), set once at load time
+
+_prototypes = (
+  # int JLINKARM_GetDLLVersion(void);
+  ('JLINKARM_GetDLLVersion', c_int, []),
+  # char *JLINKARM_GetCompileDateTime(void);
+  ('JLINKARM_GetCompileDateTime', ctypes.c_char_p, []),
+  # uint8_t JLINKARM_SelectUSB(long int port);
+  ('JLINKARM_SelectUSB', ctypes.c_ubyte, [ctypes.c_long]),
+  # long int JLINKARM_Open(void);
+  ('JLINKARM_Open', ctypes.c_long, []),
+  # void JLINKARM_Close(void);
+  ('JLINKARM_Close', None, []),
+  # int JLINKARM_GetFirmwareString(char *str, int n);
+  ('JLINKARM_GetFirmwareString', c_int, [ctypes.c_char_p, c_int]),
+  # long int JLINKARM_GetHardwareVersion(void);
+  ('JLINKARM_GetHardwareVersion', ctypes.c_long, []),
+  # long int JLINKARM_GetSN(void);
+  ('JLINKARM_GetSN', ctypes.c_long, []),
+  # void JLINKARM_GetHWStatus(JTAG_HW_STATUS * pStat);
+  ('JLINKARM_GetHWStatus', None, [c_void_p]),
+  # int JLINKARM_ExecCommand(char *sIn, char *sBuffer, int buffersize);
+  ('JLINKARM_ExecCommand', c_int, [ctypes.c_char_p, ctypes.c_char_p, c_int]),
+  # void JLINKARM_SetSpeed(long int khz);
+  ('JLINKARM_SetSpeed', None, [ctypes.c_long]),
+  # int JLINKARM_TIF_Select(int intface);
+  ('JLINKARM_TIF_Select', c_int, [c_int]),
+  # int JLINKARM_Connect(void);
+  ('JLINKARM_Connect', c_int, []),
+  # int JLINKARM_Halt(void);
+  ('JLINKARM_Halt', c_int, []),
+  # int JLINKARM_IsHalted(void);
+  ('JLINKARM_IsHalted', c_int, []),
+  # void JLINKARM_Go(void);
+  ('JLINKARM_Go', None, []),
+  # void JLINKARM_Reset(void);
+  ('JLINKARM_Reset', None, []),
+  # char JLINKARM_Step(void);
+  ('JLINKARM_Step', ctypes.c_uint8, []),
+  # uint32_t JLINKARM_ReadReg(int reg);
+  ('JLINKARM_ReadReg', c_uint32, [c_int]),
+  # void JLINKARM_WriteReg(int reg, uint32_t val);
+  ('JLINKARM_WriteReg', None, [c_int, c_uint32]),
+  # int JLINKARM_CP15_IsPresent(void);
+  ('JLINKARM_CP15_IsPresent', c_int, []),
+  # int JLINKARM_CP15_ReadEx(uint32_t crn, uint32_t crm, uint32_t op1, uint32_t op2, uint32_t *val)
+  ('JLINKARM_CP15_ReadEx', c_int, [c_uint32, c_uint32, c_uint32, c_uint32, c_void_p]),
+  # int JLINKARM_CP15_WriteEx(uint32_t crn, uint32_t crm, uint32_t op1, uint32_t op2, uint32_t val)
+  ('JLINKARM_CP15_WriteEx', c_int, [c_uint32, c_uint32, c_uint32, c_uint32, c_uint32]),
+  # int JLINKARM_ReadMemU32(uint32_t addr, uint32_t n, uint32_t *data, uint8_t *status);
+  ('JLINKARM_ReadMemU32', c_int, [c_uint32, c_uint32, c_void_p, c_void_p]),
+  # int JLINKARM_ReadMemU16(uint32_t addr, uint32_t n, uint16_t *data, uint8_t *status);
+  ('JLINKARM_ReadMemU16', c_int, [c_uint32, c_uint32, c_void_p, c_void_p]),
+  # int JLINKARM_ReadMemU8(uint32_t addr, uint32_t n, uint8_t *data, uint8_t *status);
+  ('JLINKARM_ReadMemU8', c_int, [c_uint32, c_uint32, c_void_p, c_void_p]),
+  # int JLINKARM_WriteMem(U32 addr, U32 count, const void * p);
+  ('JLINKARM_WriteMem', c_int, [c_uint32, c_uint32, c_void_p]),
+  # void JLINKARM_WriteU32(uint32_t addr, uint32_t val);
+  ('JLINKARM_WriteU32', None, [c_uint32, c_uint32]),
+  # void JLINKARM_WriteU16(uint32_t addr, uint16_t val);
+  ('JLINKARM_WriteU16', None, [c_uint32, ctypes.c_uint16]),
+  # void JLINKARM_WriteU8(uint32_t addr, uint8_t val);
+  ('JLINKARM_WriteU8', None, [c_uint32, ctypes.c_uint8]),
+)
+
+# optional functions (not in all dll versions)
+_optional_prototypes = (
+  # int JLINKARM_GetMaxMemBlock(void);
+  ('JLINKARM_GetMaxMemBlock', c_int, []),
+)
+
+# memory block size (bytes) if the dll can't tell us
+MAX_MEM_BLOCK = 16 << 10
+
+def set_prototypes(jl):
+  """set the function prototypes for the jlink library"""
+  for (name, restype, argtypes) in _prototypes:
+    fn = getattr(jl, name)
+    fn.restype = restype
+    fn.argtypes = argtypes
+  for (name, restype, argtypes) in _optional_prototypes:
+    fn = getattr(jl, name, None)
+    if fn is not None:
+      fn.restype = restype
+      fn.argtypes = argtypes
+
 # ----------------------------------------------------------------------------
 
 class JLink(object):
@@ -116,77 +207,57 @@ class JLink(object):
     self.usb_idx = idx
     # load the library
     self.jl, self.jlink_lib_name = get_jlink_dll()
+    set_prototypes(self.jl)
     self.select_usb(self.usb_idx)
     self.jlink_open()
+    # memory transfers are done with a single call for up to max_block bytes
+    self.max_block = self.get_max_mem_block()
+    self.mem_buf = (ctypes.c_uint8 * self.max_block)()
+    self.mem_status = (ctypes.c_uint8 * self.max_block)()
 
   def get_dll_version(self):
-    # int JLINKARM_GetDLLVersion(void);
-    fn = self.jl.JLINKARM_GetDLLVersion
-    fn.restype = c_int
-    fn.argtypes = []
-    return fn()
+    return self.jl.JLINKARM_GetDLLVersion()
 
   def get_compile_data_time(self):
-    # char *JLINKARM_GetCompileDateTime(void);
-    fn = self.jl.JLINKARM_GetCompileDateTime
-    fn.restype = ctypes.c_char_p
-    fn.argtypes = []
-    return fn()
+    return self.jl.JLINKARM_GetCompileDateTime()
 
   def select_usb(self, port):
-    # uint8_t JLINKARM_SelectUSB(long int port);
-    fn = self.jl.JLINKARM_SelectUSB
-    fn.restype = ctypes.c_ubyte
-    fn.argtypes = [ctypes.c_long, ]
-    return fn(ctypes.c_long(port))
+    return self.jl.JLINKARM_SelectUSB(port)
 
   def jlink_open(self):
-    # long int JLINKARM_Open(void);
-    fn = self.jl.JLINKARM_Open
-    fn.restype = ctypes.c_long
-    fn.argtypes = []
-    rc = fn()
+    rc = self.jl.JLINKARM_Open()
     if rc != 0:
       raise JLinkException('JLINKARM_Open returned %d' % rc)
 
   def jlink_close(self):
-    # void JLINKARM_Close(void);
-    fn = self.jl.JLINKARM_Close
-    fn.restype = None
-    fn.argtypes = []
-    fn()
+    self.jl.JLINKARM_Close()
 
   def get_fw_string(self):
-    # int JLINKARM_GetFirmwareString(char *str, int n);
-    fn = self.jl.JLINKARM_GetFirmwareString
-    fn.restype = c_int
-    fn.argtypes = [ctypes.c_char_p, c_int]
     buf = ctypes.create_string_buffer(128)
-    fn(buf, len(buf))
+    self.jl.JLINKARM_GetFirmwareString(buf, len(buf))
     return buf.value
 
   def get_hw_version(self):
-    # long int JLINKARM_GetHardwareVersion(void);
-    fn = self.jl.JLINKARM_GetHardwareVersion
-    fn.restype = ctypes.c_long
-    fn.argtypes = []
-    return fn()
+    return self.jl.JLINKARM_GetHardwareVersion()
 
   def get_sn(self):
-    # long int JLINKARM_GetSN(void);
-    fn = self.jl.JLINKARM_GetSN
-    fn.restype = ctypes.c_long
-    fn.argtypes = []
-    return fn()
+    return self.jl.JLINKARM_GetSN()
+
+  def get_max_mem_block(self):
+    """return the maximum memory block size (bytes) for a single transfer"""
+    fn = getattr(self.jl, 'JLINKARM_GetMaxMemBlock', None)
+    if fn is None:
+      return MAX_MEM_BLOCK
+    n = fn()
+    if n <= 0:
+      return MAX_MEM_BLOCK
+    # whole 32-bit words
+    return n & ~3
 
   def get_hw_status(self):
-    # void JLINKARM_GetHWStatus(JTAG_HW_STATUS * pStat);
-    fn = self.jl.JLINKARM_GetHWStatus
-    fn.restype = None
-    fn.argtypes = [ctypes.c_void_p,]
     n = 8
     buf = (ctypes.c_uint8 * n)()
-    fn(ctypes.byref(buf))
+    self.jl.JLINKARM_GetHWStatus(ctypes.byref(buf))
     # This is *probably* a passthrough of the dongles
     # EMU_CMD_GET_STATE operation. The Vref looks good.
     # The other values could be tested more.
@@ -202,219 +273,126 @@ class JLink(object):
     return state
 
   def exec_command(self, cmd):
-    # int JLINKARM_ExecCommand(char *sIn, char *sBuffer, int buffersize);
-    fn = self.jl.JLINKARM_ExecCommand
-    fn.restype = c_int
-    fn.argtypes = [ctypes.c_char_p, ctypes.c_char_p, c_int]
     command = ctypes.create_string_buffer(cmd)
     result = ctypes.create_string_buffer(128)
-    rc = fn(command, result, len(result))
+    rc = self.jl.JLINKARM_ExecCommand(command, result, len(result))
     if rc != 0:
       raise JLinkException('JLINKARM_ExecCommand returned %d' % rc)
     return result.value
 
   def set_speed(self, khz):
-    # void JLINKARM_SetSpeed(long int khz);
-    fn = self.jl.JLINKARM_SetSpeed
-    fn.restype = None
-    fn.argtypes = [ctypes.c_long, ]
-    fn(ctypes.c_long(khz))
+    self.jl.JLINKARM_SetSpeed(khz)
 
   def tif_select(self, tif):
-    # int JLINKARM_TIF_Select(int intface);
-    fn = self.jl.JLINKARM_TIF_Select
-    fn.restype = c_int
-    fn.argtypes = [c_int,]
-    rc = fn(c_int(tif))
+    rc = self.jl.JLINKARM_TIF_Select(tif)
     if rc != 0:
       raise JLinkException('JLINKARM_TIF_Select returned %d' % rc)
 
   def jlink_connect(self):
-    # int JLINKARM_Connect(void);
-    fn = self.jl.JLINKARM_Connect
-    fn.restype = c_int
-    fn.argtypes = []
-    rc = fn()
+    rc = self.jl.JLINKARM_Connect()
     if rc != 0:
       raise JLinkException('JLINKARM_Connect returned %d' % rc)
 
   def halt(self):
-    # int JLINKARM_Halt(void);
-    fn = self.jl.JLINKARM_Halt
-    fn.restype = c_int
-    fn.argtypes = []
-    rc = fn()
+    rc = self.jl.JLINKARM_Halt()
     if rc != 0:
       raise JLinkException('JLINKARM_Halt returned %d' % rc)
 
   def is_halted(self):
-    # int JLINKARM_IsHalted(void);
-    fn = self.jl.JLINKARM_IsHalted
-    fn.restype = c_int
-    fn.argtypes = []
-    return fn() != 0
+    return self.jl.JLINKARM_IsHalted() != 0
 
   def go(self):
-    # void JLINKARM_Go(void);
-    fn = self.jl.JLINKARM_Go
-    fn.restype = None
-    fn.argtypes = []
-    fn()
+    self.jl.JLINKARM_Go()
 
   def reset(self):
-    # void JLINKARM_Reset(void);
-    fn = self.jl.JLINKARM_Reset
-    fn.restype = None
-    fn.argtypes = []
-    fn()
+    self.jl.JLINKARM_Reset()
 
   def step(self):
-    # char JLINKARM_Step(void);
-    fn = self.jl.JLINKARM_Step
-    fn.restype = ctypes.c_uint8
-    fn.argtypes = []
-    return fn()
+    return self.jl.JLINKARM_Step()
 
   def rdreg(self, reg):
-    # uint32_t JLINKARM_ReadReg(int reg);
-    fn = self.jl.JLINKARM_ReadReg
-    fn.restype = ctypes.c_uint32
-    fn.argtypes = [c_int,]
-    return fn(c_int(reg))
+    return self.jl.JLINKARM_ReadReg(reg)
 
   def wrreg(self, reg, val):
-    # void JLINKARM_WriteReg(int reg, uint32_t val);
-    fn = self.jl.JLINKARM_WriteReg
-    fn.restype = None
-    fn.argtypes = [c_int, c_uint32]
-    fn(c_int(reg), c_uint32(val))
+    self.jl.JLINKARM_WriteReg(reg, val)
 
   def cp15_is_present(self):
-    # int JLINKARM_CP15_IsPresent(void);
-    fn = self.jl.JLINKARM_CP15_IsPresent
-    fn.restype = c_int
-    fn.argtypes = []
-    return fn() != 0
+    return self.jl.JLINKARM_CP15_IsPresent() != 0
 
   def rd_cp15(self, crn, op1, crm, op2):
-    # int JLINKARM_CP15_ReadEx(uint32_t crn, uint32_t crm, uint32_t op1, uint32_t op2, uint32_t *val)
-    fn = self.jl.JLINKARM_CP15_ReadEx
-    fn.restype = c_int
-    fn.argtypes = [c_uint32, c_uint32, c_uint32, c_uint32, c_void_p]
     val = c_uint32()
-    rc = fn(c_uint32(crn), c_uint32(crm), c_uint32(op1), c_uint32(op2), ctypes.byref(val))
+    rc = self.jl.JLINKARM_CP15_ReadEx(crn, crm, op1, op2, ctypes.byref(val))
     assert rc == 0, 'JLINKARM_CP15_ReadEx returned %d' % rc
     return val.value
 
   def wr_cp15(self, crn, op1, crm, op2, val):
-    # int JLINKARM_CP15_WriteEx(uint32_t crn, uint32_t crm, uint32_t op1, uint32_t op2, uint32_t val)
-    fn = self.jl.JLINKARM_CP15_WriteEx
-    fn.restype = c_int
-    fn.argtypes = [c_uint32, c_uint32, c_uint32, c_uint32, c_uint32]
-    rc = fn(c_uint32(crn), c_uint32(crm), c_uint32(op1), c_uint32(op2), c_uint32(val))
+    rc = self.jl.JLINKARM_CP15_WriteEx(crn, crm, op1, op2, val)
     assert rc == 0, 'JLINKARM_CP15_WriteEx returned %d' % rc
 
+  def rdmem(self, fn, name, ctype, base, n):
+    """read n values into the memory buffer, return a ctypes array view of them"""
+    assert n * ctypes.sizeof(ctype) <= self.max_block, 'read is larger than the memory block'
+    buf = (ctype * n).from_buffer(self.mem_buf)
+    # one status byte per value
+    rc = fn(base, n, buf, self.mem_status)
+    if rc < 0 or ctypes.string_at(self.mem_status, n).count('\x00') != n:
+      raise JLinkException('%s status = %d (0x%08x)' % (name, rc, base))
+    return buf
+
   def rdmem32(self, base, n):
-    # void JLINKARM_ReadMemU32(uint32_t addr, uint32_t n, uint32_t *data, uint8_t *status);
-    fn = self.jl.JLINKARM_ReadMemU32
-    fn.restype = None
-    fn.argtypes = [ctypes.c_uint32, ctypes.c_uint32, ctypes.c_void_p, ctypes.c_void_p]
-    status = ctypes.c_ubyte()
-    buf = (ctypes.c_uint32 * n)()
-    fn(ctypes.c_uint32(base), ctypes.c_uint32(n), ctypes.byref(buf), ctypes.byref(status))
-    if status.value != 0:
-      raise JLinkException('JLINKARM_ReadMemU32 status = %d (0x%08x)' % (status.value, base))
-    return [buf[i] for i in range(n)]
+    """read n 32 bit values, the returned view is valid until the next memory transfer"""
+    return self.rdmem(self.jl.JLINKARM_ReadMemU32, 'JLINKARM_ReadMemU32', ctypes.c_uint32, base, n)
 
   def rdmem16(self, base, n):
-    # void JLINKARM_ReadMemU16(uint32_t addr, uint32_t n, uint16_t *data, uint8_t *status);
-    fn = self.jl.JLINKARM_ReadMemU16
-    fn.restype = None
-    fn.argtypes = [ctypes.c_uint32, ctypes.c_uint32, ctypes.c_void_p, ctypes.c_void_p]
-    status = ctypes.c_ubyte()
-    buf = (ctypes.c_uint16 * n)()
-    fn(ctypes.c_uint32(base), ctypes.c_uint32(n), ctypes.byref(buf), ctypes.byref(status))
-    if status.value != 0:
-      raise JLinkException('JLINKARM_ReadMemU16 status = %d (0x%08x)' % (status.value, base))
-    return [buf[i] for i in range(n)]
+    """read n 16 bit values, the returned view is valid until the next memory transfer"""
+    return self.rdmem(self.jl.JLINKARM_ReadMemU16, 'JLINKARM_ReadMemU16', ctypes.c_uint16, base, n)
 
   def rdmem8(self, base, n):
-    # void JLINKARM_ReadMemU8(uint32_t addr, uint32_t n, uint8_t *data, uint8_t *status);
-    fn = self.jl.JLINKARM_ReadMemU8
-    fn.restype = None
-    fn.argtypes = [ctypes.c_uint32, ctypes.c_uint32, ctypes.c_void_p, ctypes.c_void_p]
-    status = ctypes.c_ubyte()
-    buf = (ctypes.c_uint8 * n)()
-    fn(ctypes.c_uint32(base), ctypes.c_uint32(n), ctypes.byref(buf), ctypes.byref(status))
-    if status.value != 0:
-      raise JLinkException('JLINKARM_ReadMemU8 status = %d (0x%08x)' % (status.value, base))
-    return [buf[i] for i in range(n)]
+    """read n 8 bit values, the returned view is valid until the next memory transfer"""
+    return self.rdmem(self.jl.JLINKARM_ReadMemU8, 'JLINKARM_ReadMemU8', ctypes.c_uint8, base, n)
+
+  def wrmem(self, ctype, adr, buf):
+    """write a buffer of values to a memory region"""
+    n = len(buf)
+    nbytes = n * ctypes.sizeof(ctype)
+    assert nbytes <= self.max_block, 'write is larger than the memory block'
+    cbuf = (ctype * n).from_buffer(self.mem_buf)
+    cbuf[:] = buf
+    rc = self.jl.JLINKARM_WriteMem(adr, nbytes, cbuf)
+    if rc < 0:
+      raise JLinkException('JLINKARM_WriteMem returned %d (0x%08x)' % (rc, adr))
 
   def wrmem32(self, adr, buf):
     """write a buffer of 32 bit values to a memory region"""
-    # void JLINKARM_WriteMem(U32 addr, U32 count, const void * p);
-
     # Note: I'm not sure what the underlying store is for JLINKARM_WriteMem.
     # It stores an arbitrary number of bytes without overwriting adjacent memory locations,
     # but does it do 32 bit stores when it can? I'm not sure. If you want to ensure 8/16/32
     # stores then the JLINKARM_WriteU8/16/32 calls might be a better bet. But I'm not sure
     # how they work either.
-
-    fn = self.jl.JLINKARM_WriteMem
-    fn.restype = None
-    fn.argtypes = [ctypes.c_uint32, ctypes.c_uint32, ctypes.c_void_p]
-    n = len(buf)
-    cbuf = (ctypes.c_uint32 * n)()
-    cbuf[:] = buf
-    fn(ctypes.c_uint32(adr), ctypes.c_uint32(n * 4), ctypes.byref(cbuf))
+    self.wrmem(ctypes.c_uint32, adr, buf)
 
   def wrmem16(self, adr, buf):
     """write a buffer of 16 bit values to a memory region"""
-    # void JLINKARM_WriteMem(U32 addr, U32 count, const void * p);
-    fn = self.jl.JLINKARM_WriteMem
-    fn.restype = None
-    fn.argtypes = [ctypes.c_uint32, ctypes.c_uint32, ctypes.c_void_p]
-    n = len(buf)
-    cbuf = (ctypes.c_uint16 * n)()
-    cbuf[:] = buf
-    fn(ctypes.c_uint32(adr), ctypes.c_uint32(n * 2), ctypes.byref(cbuf))
+    self.wrmem(ctypes.c_uint16, adr, buf)
 
   def wrmem8(self, adr, buf):
     """write a buffer of 8 bit values to a memory region"""
-    # void JLINKARM_WriteMem(U32 addr, U32 count, const void * p);
-    fn = self.jl.JLINKARM_WriteMem
-    fn.restype = None
-    fn.argtypes = [ctypes.c_uint32, ctypes.c_uint32, ctypes.c_void_p]
-    n = len(buf)
-    cbuf = (ctypes.c_uint8 * n)()
-    cbuf[:] = buf
-    fn(ctypes.c_uint32(adr), ctypes.c_uint32(n), ctypes.byref(cbuf))
+    self.wrmem(ctypes.c_uint8, adr, buf)
 
   def wr32(self, adr, val):
-    # void JLINKARM_WriteU32(uint32_t addr, uint32_t val);
-    fn = self.jl.JLINKARM_WriteU32
-    fn.restype = None
-    fn.argtypes = [ctypes.c_uint32, ctypes.c_uint32]
-    fn(ctypes.c_uint32(adr), ctypes.c_uint32(val))
+    self.jl.JLINKARM_WriteU32(adr, val)
 
   def wr16(self, adr, val):
-    # void JLINKARM_WriteU16(uint32_t addr, uint16_t val);
-    fn = self.jl.JLINKARM_WriteU16
-    fn.restype = None
-    fn.argtypes = [ctypes.c_uint32, ctypes.c_uint16]
-    fn(ctypes.c_uint32(adr), ctypes.c_uint16(val))
+    self.jl.JLINKARM_WriteU16(adr, val)
 
   def wr8(self, adr, val):
-    # void JLINKARM_WriteU8(uint32_t addr, uint8_t val);
-    fn = self.jl.JLINKARM_WriteU8
-    fn.restype = None
-    fn.argtypes = [ctypes.c_uint32, ctypes.c_uint8]
-    fn(ctypes.c_uint32(adr), ctypes.c_uint8(val))
+    self.jl.JLINKARM_WriteU8(adr, val)
 
   def __str__(self):
     s = []
     s.append('jlink library v%d %s' % (self.get_dll_version(), self.get_compile_data_time()))
     s.append('jlink device v%d sn%d %s' % (self.get_hw_version(), self.get_sn(), self.get_fw_string()))
+    s.append('max mem block %d bytes' % self.max_block)
     s.append('target voltage %.3fV' % (float(self.get_hw_status()['vref']) / 1000.0))
     return '\n'.join(s)
 
@@ -426,24 +404,36 @@ class dbgio(object):
   def __init__(self, idx=0):
     """no actual operations, record the selected usb device"""
     self.usb_idx = idx
+    self.chunks = {}
     self.menu = (
+      ('calibrate', self.cmd_calibrate, calibrate.help_calibrate),
       ('info', self.cmd_info),
     )
 
   def connect(self, cpu_name, itf):
     """connect the debugger to the target"""
       # create the jlink interface
-    self.jlink = JLink(self.usb_idx)
-    # check the hardware
-    state = self.jlink.get_hw_status()
-    assert state['vref'] > 1500, 'Vref is too low. Check target power.'
-    assert state['srst'] == 1, '~SRST signal is asserted. Target is held in reset.'
-    # setup the jlink interface
-    self.jlink.exec_command('device=%s' % cpu_names[cpu_name])
-    self.jlink.set_speed(4000)
-    itf = {'swd':_JLINKARM_TIF_SWD, 'jtag':_JLINKARM_TIF_JTAG}[itf]
-    self.jlink.tif_select(itf)
-    self.jlink.jlink_connect()
+    startup.start('probe init')
+    try:
+      self.jlink = JLink(self.usb_idx)
+      # check the hardware
+      state = self.jlink.get_hw_status()
+      assert state['vref'] > 1500, 'Vref is too low. Check target power.'
+      assert state['srst'] == 1, '~SRST signal is asserted. Target is held in reset.'
+      # setup the jlink interface
+      self.jlink.exec_command('device=%s' % cpu_names[cpu_name])
+      self.jlink.set_speed(4000)
+      itf = {'swd':_JLINKARM_TIF_SWD, 'jtag':_JLINKARM_TIF_JTAG}[itf]
+      self.jlink.tif_select(itf)
+      self.jlink.jlink_connect()
+    finally:
+      startup.stop()
+    # read a memory block per call, or use the calibrated chunk sizes for this probe
+    self.chunks = self.block_chunks()
+    # the saved sizes are per probe, the block size is from the dll: clamp them to a block
+    for (k, n) in calibrate.load_chunks(self.chunk_key()).items():
+      if self.chunks.has_key(k):
+        self.chunks[k] = min(n, self.chunks[k])
 
   def disconnect(self):
     """disconnect the debugger from the target"""
@@ -453,6 +443,44 @@ class dbgio(object):
     """display jlink information"""
     ui.put('%s\n' % self)
 
+  def chunk_key(self):
+    """return the key for the calibrated chunk sizes (probe model and firmware)"""
+    return 'jlink hw %d %s' % (self.jlink.get_hw_version(), self.jlink.get_fw_string())
+
+  def block_chunks(self):
+    """return the values per memory read call for a full memory block"""
+    n = self.jlink.max_block
+    return {'rd32': n / 4, 'rd16': n / 2, 'rd8': n}
+
+  def cmd_calibrate(self, ui, args):
+    """measure and save the memory read chunk sizes"""
+    def rd(name, fn, width):
+      def test(adr, nvals, n):
+        self.chunks[name] = n
+        fn(adr, nvals, iobuf.data_buffer(width))
+      return test
+    block = self.block_chunks()
+    sizes = (16, 64, 256, 1024, 4096, 16384)
+    tests = (
+      ('rd32', rd('rd32', self.rdmem32, 32), [n for n in sizes if n <= block['rd32']], 32, block['rd32']),
+      ('rd16', rd('rd16', self.rdmem16, 16), [n for n in sizes if n <= block['rd16']], 16, block['rd16']),
+      ('rd8', rd('rd8', self.rdmem8, 8), [n for n in sizes if n <= block['rd8']], 8, block['rd8']),
+    )
+    # the tests use the real transfer loops, put back the chunks if they fail
+    save = dict(self.chunks)
+    chunks = None
+    try:
+      chunks = calibrate.calibrate(ui, args, self, tests, (AssertionError, JLinkException))
+    finally:
+      self.chunks = save
+    if chunks is None:
+      return
+    # only the sizes are used
+    chunks = dict([(k, chunks[k]) for k in block.keys()])
+    self.chunks.update(chunks)
+    calibrate.save_chunks(self.chunk_key(), chunks)
+    ui.put('rd32 %d, rd16 %d, rd8 %d (saved for %s)\n' % (chunks['rd32'], chunks['rd16'], chunks['rd8'], self.chunk_key()))
+
   def is_halted(self):
     """return True if target is halted"""
     return self.jlink.is_halted()
@@ -476,6 +504,10 @@ class dbgio(object):
       return None
     return self.jlink.rdreg(n)
 
+  def rdregs(self, regs):
+    """read a list of named registers, return a list of values (None if unknown)"""
+    return [self.rdreg(reg) for reg in regs]
+
   def wrreg(self, reg, val):
     """write to the named register"""
     n = regmap.get(reg, None)
@@ -485,7 +517,7 @@ class dbgio(object):
 
   def rdmem32(self, adr, n, io):
     """read n 32-bit values from memory region"""
-    max_n = 16
+    max_n = self.chunks['rd32']
     while n > 0:
       nread = (n, max_n)[n >= max_n]
       [io.wr32(x) for x in self.jlink.rdmem32(adr, nread)]
@@ -494,7 +526,7 @@ class dbgio(object):
 
   def rdmem16(self, adr, n, io):
     """read n 16-bit values from memory region"""
-    max_n = 32
+    max_n = self.chunks['rd16']
     while n > 0:
       nread = (n, max_n)[n >= max_n]
       [io.wr16(x) for x in self.jlink.rdmem16(adr, nread)]
@@ -503,7 +535,7 @@ class dbgio(object):
 
   def rdmem8(self, adr, n, io):
     """read n 8-bit values from memory region"""
-    max_n = 64
+    max_n = self.chunks['rd8']
     while n > 0:
       nread = (n, max_n)[n >= max_n]
       [io.wr8(x) for x in self.jlink.rdmem8(adr, nread)]
@@ -523,15 +555,30 @@ class dbgio(object):
 
   def wrmem32(self, adr, n, io):
     """write n 32-bit words to memory starting at adr"""
-    self.jlink.wrmem32(adr, [io.rd32() for i in xrange(n)])
+    max_n = self.jlink.max_block / 4
+    while n > 0:
+      nwrite = (n, max_n)[n >= max_n]
+      self.jlink.wrmem32(adr, [io.rd32() for i in xrange(nwrite)])
+      n -= nwrite
+      adr += nwrite * 4
 
   def wrmem16(self, adr, n, io):
     """write n 16-bit words to memory starting at adr"""
-    self.jlink.wrmem16(adr, [io.rd16() for i in xrange(n)])
+    max_n = self.jlink.max_block / 2
+    while n > 0:
+      nwrite = (n, max_n)[n >= max_n]
+      self.jlink.wrmem16(adr, [io.rd16() for i in xrange(nwrite)])
+      n -= nwrite
+      adr += nwrite * 2
 
   def wrmem8(self, adr, n, io):
     """write n 8-bit words to memory starting at adr"""
-    self.jlink.wrmem8(adr, [io.rd8() for i in xrange(n)])
+    max_n = self.jlink.max_block
+    while n > 0:
+      nwrite = (n, max_n)[n >= max_n]
+      self.jlink.wrmem8(adr, [io.rd8() for i in xrange(nwrite)])
+      n -= nwrite
+      adr += nwrite
 
   def wrmem(self, adr, n, io):
     """write a buffer to memory starting at adr"""
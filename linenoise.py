@@ -677,11 +677,12 @@ class linenoise(object):
     else:
       return self.read_raw(prompt, s)
 
-  def loop(self, fn, exit_key=_KEY_CTRL_D):
+  def loop(self, fn, exit_key=_KEY_CTRL_D, timeout=0.01):
     """
     Call the provided function in a loop.
     Exit when the function returns True or when the exit key is pressed.
     Returns True when the loop function completes, False for early exit.
+    timeout is the time to wait for the exit key between calls.
     """
     if self.enable_rawmode(_STDIN) == -1:
       return
@@ -691,7 +692,7 @@ class linenoise(object):
         # the loop function has completed
         rc = True
         break
-      if _getc(_STDIN, timeout=0.01) == exit_key:
+      if _getc(_STDIN, timeout=timeout) == exit_key:
         # the loop has been cancelled
         rc = False
         break
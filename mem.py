@@ -240,6 +240,8 @@ class mem(object):
       ui.put('address   0        4        8        C\n')
     else:
       assert False, 'bad width'
+    # annotate each line with the peripheral registers it contains
+    amap = self.cpu.device.address_map()
     # read and print the data
     for i in xrange(n/16):
       # read 4, 32-bit words (16 bytes per line)
@@ -251,6 +253,9 @@ class mem(object):
       # work out the ascii string
       io.convert(8, 'le')
       ascii_str = io.ascii_str()
+      names = amap.register_names(adr, 16)
+      if names:
+        ascii_str = '%s  %s: %s' % (ascii_str, amap.peripheral(adr).name, ' '.join(names))
       ui.put('%08x: %s  %s\n' % (adr, data_str, ascii_str))
       adr += 16
 
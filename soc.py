@@ -12,6 +12,15 @@ code.
 """
 # -----------------------------------------------------------------------------
 
+import gc
+import sys
+import csv
+import gzip
+import time
+import bisect
+import copy
+import types
+
 import svd
 import util
 
@@ -19,12 +28,28 @@ import util
 
 help_regs = (
   ('<cr>', 'display cpu registers'),
-  ('[name]', 'display registers for peripheral')
+  ('[name]', 'display registers for peripheral'),
+  ('snapshot <file>', 'save all peripheral registers to a file'),
+  ('diff <a> [b]', 'display register differences a -> b (default b: live)'),
+  ('', 'a, b: snapshot file, live or reset (svd reset values)'),
+)
+
+help_watch = (
+  ('<name> [register ...]', 'watch peripheral registers, display changed fields'),
+  ('-hz <n>', 'sample rate (default: as fast as possible)'),
+  ('-o <file>', 'write the changes to a csv file'),
+  ('', 'Ctrl-D to exit'),
 )
 
 # -----------------------------------------------------------------------------
 # utility functions
 
+def intern_string(s):
+  """intern a name string - the same names are used many times"""
+  if type(s) is str:
+    return intern(s)
+  return s
+
 def description_cleanup(s):
   """cleanup a description string"""
   if s is None:
@@ -33,7 +58,8 @@ def description_cleanup(s):
   s = s.encode('ascii', errors = 'ignore')
   s = s.strip('."')
   # remove un-needed white space
-  return ' '.join([x.strip() for x in s.split()])
+  # intern it - descriptions are often repeated (E.g. "Reserved")
+  return intern(' '.join([x.strip() for x in s.split()]))
 
 def name_cleanup(s):
   """cleanup a register name"""
@@ -130,6 +156,8 @@ def attribute_hex(x):
 
 class interrupt(object):
 
+  __slots__ = ('name', 'description', 'irq', 'parent')
+
   def __init__(self):
     pass
 
@@ -146,6 +174,8 @@ class interrupt(object):
 
 class enumval(object):
 
+  __slots__ = ('name', 'description', 'value', 'isDefault', 'parent')
+
   def __init__(self):
     pass
 
@@ -162,6 +192,8 @@ class enumval(object):
 
 class enumvals(object):
 
+  __slots__ = ('name', 'usage', 'enumval', 'parent')
+
   def __init__(self):
     pass
 
@@ -181,59 +213,109 @@ class enumvals(object):
     s.append('enumvals.append(e)\n')
     return '\n'.join(s)
 
+# -----------------------------------------------------------------------------
+# field decode plans
+# A plan entry is (field, mask, lsb, label, value names, fmt). A register's
+# plan is the tuple of entries for its fields in most significant bit order.
+# The entry is cached on the field, and assigning the field enumvals or fmt
+# drops it. Fields are shared by registers, so a register checks that its plan
+# still holds the entries of its fields (see register.decode_plan).
+
+def decode_name(entry, x):
+  """return the name for a (masked and shifted) field value"""
+  (f, mask, lsb, label, names, fmt) = entry
+  if fmt is not None:
+    return fmt(x)
+  if names is not None and names.has_key(x):
+    return names[x].name
+  return ''
+
+def decode_display(entry, val, old):
+  """return display columns (name, val, '', descr) for a field"""
+  (f, mask, lsb, label, names, fmt) = entry
+  x = (val >> lsb) & mask
+  # work out if the value has changed since the register was last displayed
+  changed = '  '
+  if old is not None and ((old >> lsb) & mask) != x:
+    changed = ' *'
+  val_name = decode_name(entry, x)
+  # only format the string that is used
+  if x < 10:
+    val_str = ': %d %s%s' % (x, val_name, changed)
+  else:
+    val_str = ': 0x%x %s%s' % (x, val_name, changed)
+  return [label, val_str, '', f.description]
+
 # -----------------------------------------------------------------------------
 
 class field(object):
+  """
+  A register bit field.
+  Fields are shared by all the registers built from the same svd register.
+  E.g. the elements of a dim array, or the registers of derived peripherals.
+  Identical enumvals are shared between fields.
+  Use register.unshare() before modifying fields.
+  """
+
+  __slots__ = ('name', 'description', 'msb', 'lsb', '_enumvals', '_fmt', 'entry', 'parent')
 
   def __init__(self):
-    self.fmt = None
-    self.cached_val = None
+    self._enumvals = None
+    self._fmt = None
+    self.entry = None
+
+  def changed(self):
+    """drop the decode entry for this field"""
+    self.entry = None
+
+  def get_enumvals(self):
+    return self._enumvals
+
+  def set_enumvals(self, enumvals):
+    self._enumvals = enumvals
+    self.changed()
+
+  enumvals = property(get_enumvals, set_enumvals)
+
+  def get_fmt(self):
+    return self._fmt
+
+  def set_fmt(self, fmt):
+    self._fmt = fmt
+    self.changed()
+
+  fmt = property(get_fmt, set_fmt)
+
+  def decode_entry(self):
+    """return the decode plan entry for this field"""
+    if self.entry is not None:
+      return self.entry
+    mask = (1 << (self.msb - self.lsb + 1)) - 1
+    if self.msb == self.lsb:
+      label = '  %s[%d]' % (self.name, self.lsb)
+    else:
+      label = '  %s[%d:%d]' % (self.name, self.msb, self.lsb)
+    names = None
+    fmt = None
+    if callable(self._fmt):
+      fmt = self._fmt
+    elif self._enumvals is not None and len(self._enumvals) >= 1:
+      # find the enumvals with usage 'read', or just find one
+      for e in self._enumvals:
+        if e.usage == 'read':
+          break
+      names = e.enumval
+    self.entry = (self, mask, self.lsb, label, names, fmt)
+    return self.entry
 
   def field_name(self, val):
     """return the name for the field value"""
-    mask = ((1 << (self.msb - self.lsb + 1)) - 1) << self.lsb
-    val = (val & mask) >> self.lsb
-    val_name = ''
-    if callable(self.fmt):
-      val_name = self.fmt(val)
-    else:
-      if self.enumvals is not None and len(self.enumvals) >= 1:
-        # find the enumvals with usage 'read', or just find one
-        for e in self.enumvals:
-          if e.usage == 'read':
-            break
-        if e.enumval.has_key(val):
-          val_name = e.enumval[val].name
-    return val_name
-
-  def display(self, val):
+    entry = self.decode_entry()
+    return decode_name(entry, (val >> entry[2]) & entry[1])
+
+  def display(self, val, old = None):
     """return display columns (name, val, '', descr) for this field"""
-    mask = ((1 << (self.msb - self.lsb + 1)) - 1) << self.lsb
-    val = (val & mask) >> self.lsb
-    # work out if the value has changed since we last displayed it
-    changed = '  '
-    if self.cached_val is None:
-      self.cached_val = val
-    elif self.cached_val != val:
-      self.cached_val = val
-      changed = ' *'
-    if self.msb == self.lsb:
-      name = '  %s[%d]' % (self.name, self.lsb)
-    else:
-      name = '  %s[%d:%d]' % (self.name, self.msb, self.lsb)
-    val_name = ''
-    if callable(self.fmt):
-      val_name = self.fmt(val)
-    else:
-      if self.enumvals is not None and len(self.enumvals) >= 1:
-        # find the enumvals with usage 'read', or just find one
-        for e in self.enumvals:
-          if e.usage == 'read':
-            break
-        if e.enumval.has_key(val):
-          val_name = e.enumval[val].name
-    val_str = (': 0x%x %s%s' % (val, val_name, changed), ': %d %s%s' % (val, val_name, changed))[val < 10]
-    return [name, val_str, '', self.description]
+    return decode_display(self.decode_entry(), val, old)
 
   def __str__(self):
     s = []
@@ -256,21 +338,72 @@ class field(object):
 # -----------------------------------------------------------------------------
 
 class register(object):
+  """
+  A peripheral register.
+  The name, offset, parent peripheral and cached value belong to this
+  register. The description, size and fields may be shared with other
+  registers built from the same svd register.
+  access, readAction and resetValue are the svd values (None if not given).
+  The field decode plan is compiled on first use, and again after any field
+  enumvals or fmt are changed.
+  """
+
+  __slots__ = ('name', 'description', 'size', 'offset', 'fields', 'access', 'readAction', 'resetValue', 'parent', 'cpu', 'cached_val', 'plan')
 
   def __init__(self):
+    self.access = None
+    self.readAction = None
+    self.resetValue = None
     self.cached_val = None
+    self.plan = None
 
   def __getattr__(self, name):
     """make the field name a class attribute"""
+    if name.startswith('__'):
+      # don't hide the python internals (E.g. pickling)
+      raise AttributeError(name)
     return self.fields[name]
 
   def bind_cpu(self, cpu):
     """bind a cpu to the register"""
     self.cpu = cpu
 
+  def clone(self, parent):
+    """return a register for another peripheral sharing this register's definition"""
+    r = register()
+    r.name = self.name
+    r.description = self.description
+    r.size = self.size
+    r.offset = self.offset
+    r.fields = self.fields
+    r.access = self.access
+    r.readAction = self.readAction
+    r.resetValue = self.resetValue
+    r.plan = self.plan
+    r.parent = parent
+    return r
+
+  def unshare(self):
+    """give this register its own copy of the fields, so they can be modified"""
+    if self.fields is None:
+      return
+    fields = {}
+    for f in self.fields.values():
+      f = copy.copy(f)
+      f.parent = self
+      # the entry refers to the shared field
+      f.entry = None
+      fields[f.name] = f
+    self.fields = fields
+    self.plan = None
+
   def adr(self, idx, size):
     return self.parent.address + self.offset + (idx * (size / 8))
 
+  def readable(self):
+    """return True if the register can be read"""
+    return self.access not in ('write-only', 'writeOnce')
+
   def rd(self, idx = 0):
     return self.cpu.rd(self.adr(idx, self.size), self.size)
 
@@ -286,25 +419,54 @@ class register(object):
   def clr_bit(self, val, idx = 0):
     self.wr(self.rd(idx) & ~val, idx)
 
-  def field_list(self):
-    """return an ordered fields list"""
-    # build a list of fields in most significant bit order
+  def compile(self):
+    """compile the field decode plan (again, after the fields are changed)"""
+    if self.fields is None:
+      self.plan = ()
+      return
+    # fields in most significant bit order
     f_list = self.fields.values()
     f_list.sort(key = lambda x : x.msb, reverse = True)
-    return f_list
+    self.plan = tuple([f.decode_entry() for f in f_list])
+
+  def decode_plan(self):
+    """return the field decode plan"""
+    if self.plan is None:
+      self.compile()
+      return self.plan
+    # a field edit (enumvals, fmt) drops the field entry
+    for entry in self.plan:
+      if entry[0].entry is not entry:
+        self.compile()
+        break
+    return self.plan
 
-  def display(self, display_fields):
+  def field_list(self):
+    """return an ordered fields list"""
+    return [entry[0] for entry in self.decode_plan()]
+
+  def decode(self, val):
+    """return a list of (field, value, value name) for a register value"""
+    l = []
+    for entry in self.decode_plan():
+      x = (val >> entry[2]) & entry[1]
+      l.append((entry[0], x, decode_name(entry, x)))
+    return l
+
+  def display(self, display_fields, val = None):
     """return display columns (name, adr, val, descr) for this register"""
     adr = self.adr(0, self.size)
-    val = self.rd()
+    adr_str = ': %08x[%d:0]' % (adr, self.size - 1)
+    if not self.readable():
+      return [[self.name, adr_str, '(write-only)', self.description]]
+    if val is None:
+      val = self.rd()
     # work out if the value has changed since we last displayed it
+    old = self.cached_val
     changed = '  '
-    if self.cached_val is None:
-      self.cached_val = val
-    elif self.cached_val != val:
-      self.cached_val = val
+    if old is not None and old != val:
       changed = ' *'
-    adr_str = ': %08x[%d:0]' % (adr, self.size - 1)
+    self.cached_val = val
     if val == 0:
       val_str = '= 0%s' % changed
     else:
@@ -314,8 +476,8 @@ class register(object):
     clist.append([self.name, adr_str, val_str, self.description])
     # output the fields
     if display_fields and self.fields:
-      for f in self.field_list():
-        clist.append(f.display(val))
+      for entry in self.decode_plan():
+        clist.append(decode_display(entry, val, old))
     return clist
 
   def __str__(self):
@@ -339,17 +501,59 @@ class register(object):
 # -----------------------------------------------------------------------------
 
 class peripheral(object):
+  """
+  A peripheral.
+  A lazily built peripheral starts as a stub with the name, description,
+  address and size. The registers are built on first use.
+  The register interval index (for address lookups) is built on first use,
+  and dropped when the registers are assigned or renamed.
+  """
+
+  __slots__ = ('name', 'description', 'address', 'size', 'default_register_size', '_registers', 'parent', 'cpu', 'lazy', 'reg_index')
 
   def __init__(self):
-    pass
+    self.cpu = None
+    # (svd parser, svd peripheral, register definitions) for a stub
+    self.lazy = None
+    self.reg_index = None
+
+  def get_registers(self):
+    return self._registers
+
+  def set_registers(self, registers):
+    self._registers = registers
+    self.reg_index = None
+
+  registers = property(get_registers, set_registers)
 
   def __getattr__(self, name):
     """make the register name a class attribute"""
+    if name.startswith('__'):
+      # don't hide the python internals (E.g. pickling)
+      raise AttributeError(name)
+    if self.lazy is not None:
+      # a stub, build the registers and try again
+      self.materialize()
+      return getattr(self, name)
     return self.registers[name]
 
+  def materialize(self):
+    """build the registers for a stub peripheral"""
+    if self.lazy is None:
+      return
+    (parser, svd_p, defs) = self.lazy
+    self.lazy = None
+    parser.peripheral_registers(svd_p)
+    build_registers(self, svd_p, defs)
+    if self.cpu is not None:
+      self.bind_cpu(self.cpu)
+
   def bind_cpu(self, cpu):
     """bind a cpu to the peripheral"""
     self.cpu = cpu
+    if self.lazy is not None:
+      # the registers will be bound when they are built
+      return
     if self.registers:
       for r in self.registers.values():
         r.bind_cpu(cpu)
@@ -366,6 +570,59 @@ class peripheral(object):
     r_list.sort(key = lambda x : (x.offset << 16) + sum(bytearray(x.name)))
     return r_list
 
+  def read_plan(self, r_list):
+    """
+    return a plan for reading a list of registers: [(base, size, n, [(index, register)])]
+    contiguous 32-bit (or 8-bit) registers are read with a single block read
+    """
+    plan = []
+    # size: [(address, register)] for the aligned 32-bit and 8-bit registers
+    blocks = {}
+    for r in r_list:
+      adr = r.adr(0, r.size)
+      if r.size in (32, 8) and adr % (r.size >> 3) == 0:
+        blocks.setdefault(r.size, []).append((adr, r))
+      else:
+        plan.append((adr, r.size, 1, [(0, r)]))
+    for (size, items) in blocks.iteritems():
+      step = size >> 3
+      items.sort(key = lambda x : x[0])
+      i = 0
+      while i < len(items):
+        # find the run of contiguous (or aliased) registers starting at i
+        j = i + 1
+        while j < len(items) and items[j][0] - items[j - 1][0] in (0, step):
+          j += 1
+        base = items[i][0]
+        nread = ((items[j - 1][0] - base) / step) + 1
+        plan.append((base, size, nread, [((adr - base) / step, r) for (adr, r) in items[i:j]]))
+        i = j
+    return plan
+
+  def run_read_plan(self, plan):
+    """read the registers with a read plan, return {register name: value}"""
+    import iobuf
+    vals = {}
+    for (base, size, nread, items) in plan:
+      if nread == 1:
+        buf = [items[0][1].rd(),]
+      else:
+        # the access size is the register size
+        io = iobuf.data_buffer(size)
+        if size == 32:
+          self.cpu.rdmem32(base, nread, io)
+        else:
+          self.cpu.rdmem(base, nread, io)
+        buf = io.buf
+      for (i, r) in items:
+        vals[r.name] = buf[i]
+    return vals
+
+  def read_registers(self, r_list):
+    """read a list of registers, return ({register name: value}, number of reads)"""
+    plan = self.read_plan(r_list)
+    return (self.run_read_plan(plan), len(plan))
+
   def display(self, register_name = None, fields= False):
     """return a display string for this peripheral"""
     if self.registers:
@@ -374,11 +631,22 @@ class peripheral(object):
         # decode a single register
         r = self.registers[register_name]
         clist.extend(r.display(fields))
-      else:
-        # decode all registers
-        for r in self.register_list():
+        return util.display_cols(clist, [0,0,0,0])
+      # decode all registers from a snapshot
+      # registers with read side effects (E.g. clear on read) are not read
+      r_list = self.register_list()
+      rd_list = [r for r in r_list if r.readable() and r.readAction is None]
+      (vals, n) = self.read_registers(rd_list)
+      for r in r_list:
+        if vals.has_key(r.name):
+          clist.extend(r.display(fields, vals[r.name]))
+        elif r.readable():
+          adr_str = ': %08x[%d:0]' % (r.adr(0, r.size), r.size - 1)
+          clist.append([r.name, adr_str, '(read %s)' % r.readAction, r.description])
+        else:
           clist.extend(r.display(fields))
-      return util.display_cols(clist, [0,0,0,0])
+      s = util.display_cols(clist, [0,0,0,0])
+      return '%s\n%d registers read in %d transactions' % (s, len(vals), n)
     else:
       return 'no registers for %s' % self.name
 
@@ -389,6 +657,7 @@ class peripheral(object):
       del self.registers[old]
       self.registers[new] = r
       r.name = new
+      self.reg_index = None
 
   def __str__(self):
     s = []
@@ -443,6 +712,242 @@ class cpu_info(object):
 
 # -----------------------------------------------------------------------------
 
+class interval_index(object):
+  """find the objects with an [start, end] interval containing an address"""
+
+  def __init__(self, items):
+    # items: (start, end, object)
+    items = sorted(items, key = lambda x : x[0])
+    self.starts = [x[0] for x in items]
+    self.ends = [x[1] for x in items]
+    self.objs = [x[2] for x in items]
+    # the maximum end of items[0:i+1], so overlapping intervals can be found
+    self.maxend = []
+    end = -1
+    for x in self.ends:
+      end = max(end, x)
+      self.maxend.append(end)
+
+  def find(self, adr):
+    """return a list of the objects containing adr, highest start first"""
+    objs = []
+    i = bisect.bisect_right(self.starts, adr) - 1
+    while i >= 0 and self.maxend[i] >= adr:
+      if self.ends[i] >= adr:
+        objs.append(self.objs[i])
+      i -= 1
+    return objs
+
+  def starting(self, adr, n):
+    """return a list of the objects starting within [adr, adr + n)"""
+    i = bisect.bisect_left(self.starts, adr)
+    j = bisect.bisect_left(self.starts, adr + n)
+    return self.objs[i:j]
+
+class address_map(object):
+  """
+  Reverse decode of addresses: address -> peripheral.register.field.
+  The peripheral index is built once. The register index for a peripheral is
+  built on first use and kept on the peripheral, so only the peripherals that
+  are looked up are built for a lazily built device.
+  """
+
+  def __init__(self, device):
+    items = []
+    for p in device.peripheral_list():
+      # a peripheral without a size covers its base address
+      size = max(p.size or 0, 1)
+      items.append((p.address, p.address + size - 1, p))
+    self.peripherals = interval_index(items)
+
+  def register_index(self, p):
+    """return the register interval index for a peripheral"""
+    # a stub is built by the p.registers access
+    registers = p.registers
+    if p.reg_index is None:
+      items = []
+      if registers:
+        for r in registers.values():
+          adr = p.address + r.offset
+          items.append((adr, adr + ((r.size or 32) >> 3) - 1, r))
+      # tie break with the name to give a well-defined order
+      items.sort(key = lambda x : x[2].name)
+      p.reg_index = interval_index(items)
+    return p.reg_index
+
+  def peripheral(self, adr):
+    """return the peripheral containing adr (or None)"""
+    p_list = self.peripherals.find(adr)
+    if p_list:
+      return p_list[0]
+    return None
+
+  def lookup(self, adr):
+    """return (peripheral, [registers]) for an address"""
+    p = self.peripheral(adr)
+    if p is None:
+      return (None, [])
+    return (p, self.register_index(p).find(adr))
+
+  def register(self, adr):
+    """return the register containing adr (or None)"""
+    (p, r_list) = self.lookup(adr)
+    if r_list:
+      return r_list[0]
+    return None
+
+  def fields(self, adr, val = None):
+    """return [(field, value)] for the register containing adr"""
+    r = self.register(adr)
+    if r is None or r.fields is None:
+      return []
+    if val is None:
+      return [(f, None) for f in r.field_list()]
+    return [(f, x) for (f, x, name) in r.decode(val)]
+
+  def register_names(self, adr, n):
+    """return the names of the registers starting within [adr, adr + n)"""
+    p = self.peripheral(adr)
+    if p is None:
+      return []
+    return [r.name for r in self.register_index(p).starting(adr, n)]
+
+  def name(self, adr):
+    """return a symbolic name for an address (or None)"""
+    (p, r_list) = self.lookup(adr)
+    if p is None:
+      return None
+    if not r_list:
+      return '%s+0x%x' % (p.name, adr - p.address)
+    # aliased registers (E.g. input/output modes) share an address
+    names = '/'.join([r.name for r in r_list])
+    ofs = adr - (p.address + r_list[0].offset)
+    if ofs:
+      return '%s.%s+%d' % (p.name, names, ofs)
+    return '%s.%s' % (p.name, names)
+
+# -----------------------------------------------------------------------------
+# register snapshots: {(address, size): value}
+
+def save_snapshot(path, name, snap):
+  """save a register snapshot to a compressed file"""
+  f = gzip.open(path, 'wb')
+  f.write('# pycs register snapshot\n')
+  f.write('# device %s\n' % name)
+  for ((adr, size), val) in sorted(snap.items()):
+    f.write('%08x %d %x\n' % (adr, size, val))
+  f.close()
+
+def load_snapshot(path):
+  """load a register snapshot from a file"""
+  snap = {}
+  f = gzip.open(path, 'rb')
+  for l in f:
+    if l.startswith('#'):
+      continue
+    x = l.split()
+    snap[(int(x[0], 16), int(x[1]))] = int(x[2], 16)
+  f.close()
+  return snap
+
+# -----------------------------------------------------------------------------
+
+class register_watch(object):
+  """
+  Poll a list of peripheral registers (with a read plan) and report the
+  changed fields. The poll function is called from the linenoise loop.
+  """
+
+  def __init__(self, ui, p, r_list, hz = None, f = None):
+    self.ui = ui
+    self.p = p
+    self.r_list = r_list
+    self.plan = p.read_plan(r_list)
+    self.period = None
+    if hz is not None:
+      self.period = 1.0 / hz
+    self.writer = None
+    if f is not None:
+      self.writer = csv.writer(f)
+      self.writer.writerow(('time', 'register', 'field', 'old', 'new', 'name'))
+    self.vals = None
+    self.samples = 0
+    self.dropped = 0
+    self.changes = 0
+
+  def timeout(self):
+    """return the exit key timeout for the loop"""
+    if self.period is None:
+      return 0
+    return min(0.01, self.period / 4.0)
+
+  def start(self):
+    """read and display the initial register values"""
+    self.vals = self.p.run_read_plan(self.plan)
+    self.t_start = time.time()
+    self.t_next = self.t_start
+    clist = []
+    for r in self.r_list:
+      clist.extend(r.display(True, self.vals[r.name]))
+    self.ui.put('%s\n' % util.display_cols(clist, [0,0,0,0]))
+
+  def change(self, t, r, entry, old, new):
+    """report a changed field (or register if entry is None)"""
+    self.changes += 1
+    if entry is None:
+      (f_name, x, y, val_name) = ('', old, new, '')
+    else:
+      (f, mask, lsb) = entry[:3]
+      x = (old >> lsb) & mask
+      y = (new >> lsb) & mask
+      (f_name, val_name) = (f.name, decode_name(entry, y))
+    if self.writer is not None:
+      self.writer.writerow(('%.6f' % t, r.name, f_name, x, y, val_name))
+    else:
+      name = ('%s.%s' % (r.name, f_name), r.name)[entry is None]
+      self.ui.put('%10.6f %s: 0x%x -> 0x%x %s\n' % (t, name, x, y, val_name))
+
+  def poll(self):
+    """take a sample if one is due"""
+    t = time.time()
+    if self.period is not None:
+      if t < self.t_next:
+        return
+      # samples we were too late for are dropped
+      missed = int((t - self.t_next) / self.period)
+      self.dropped += missed
+      self.t_next += (missed + 1) * self.period
+    vals = self.p.run_read_plan(self.plan)
+    self.samples += 1
+    t -= self.t_start
+    for r in self.r_list:
+      new = vals[r.name]
+      old = self.vals[r.name]
+      if new == old:
+        continue
+      plan = r.decode_plan()
+      if not plan:
+        self.change(t, r, None, old, new)
+      diff = old ^ new
+      for entry in plan:
+        if (diff >> entry[2]) & entry[1]:
+          self.change(t, r, entry, old, new)
+    self.vals = vals
+
+  def report(self):
+    """return the sampling report string"""
+    t = time.time() - self.t_start
+    rate = (0.0, self.samples / t)[t > 0]
+    s = []
+    s.append('%d samples in %.2f s (%.1f Hz)' % (self.samples, t, rate))
+    if self.period is not None:
+      s.append('%d dropped' % self.dropped)
+    s.append('%d changes' % self.changes)
+    s.append('%d transactions/sample' % len(self.plan))
+    return ', '.join(s)
+
+# -----------------------------------------------------------------------------
+
 class device(object):
 
   def __init__(self):
@@ -450,24 +955,42 @@ class device(object):
 
   def __getattr__(self, name):
     """make the peripheral name a class attribute"""
+    if name.startswith('__'):
+      # don't hide the python internals (E.g. pickling)
+      raise AttributeError(name)
     return self.peripherals[name]
 
+  def address_map(self):
+    """return the address map for the device (built on first use)"""
+    amap = self.__dict__.get('amap')
+    if amap is None:
+      amap = address_map(self)
+      self.amap = amap
+    return amap
+
   def bind_cpu(self, cpu):
     """bind a cpu to the device"""
     self.cpu = cpu
     for p in self.peripherals.values():
       p.bind_cpu(cpu)
 
+  def materialize(self):
+    """build the registers for any stub peripherals"""
+    for p in self.peripherals.values():
+      p.materialize()
+
   def insert(self, p):
     """insert a peripheral into the device"""
     assert self.peripherals.has_key(p.name) == False, 'device already has peripheral %s' % p.name
     p.parent = self
     self.peripherals[p.name] = p
+    self.__dict__.pop('amap', None)
 
   def remove(self, p):
     """remove a peripheral from the device"""
     assert self.peripherals.has_key(p.name) == True, 'device does not have peripheral %s' % p.name
     del self.peripherals[p.name]
+    self.__dict__.pop('amap', None)
 
   def peripheral_list(self):
     """return an ordered peripheral list"""
@@ -498,8 +1021,165 @@ class device(object):
       clist.append([p.name, region, p.description])
     ui.put('%s\n' % util.display_cols(clist, [0,0,0]))
 
+  def snapshot(self):
+    """read all the peripheral registers, return (snapshot, number of reads)"""
+    snap = {}
+    n = 0
+    for p in self.peripheral_list():
+      if not p.registers:
+        continue
+      # registers with read side effects are not read
+      r_list = [r for r in p.registers.values() if r.readable() and r.readAction is None]
+      (vals, k) = p.read_registers(r_list)
+      n += k
+      for r in r_list:
+        snap[(r.adr(0, r.size), r.size)] = vals[r.name]
+    return (snap, n)
+
+  def reset_values(self):
+    """return a snapshot of the svd reset values"""
+    snap = {}
+    for p in self.peripheral_list():
+      if not p.registers:
+        continue
+      for r in p.registers.values():
+        if r.resetValue is not None and r.readable() and r.readAction is None:
+          snap[(r.adr(0, r.size), r.size)] = r.resetValue & ((1 << r.size) - 1)
+    return snap
+
+  def display_diff(self, a, b):
+    """return a display string for the register differences between snapshots a -> b"""
+    amap = self.address_map()
+    keys = sorted(set(a.keys()) & set(b.keys()))
+    clist = []
+    n = 0
+    for (adr, size) in keys:
+      old = a[(adr, size)]
+      new = b[(adr, size)]
+      if old == new:
+        continue
+      n += 1
+      (p, r_list) = amap.lookup(adr)
+      r_list = [r for r in r_list if r.size == size and p.address + r.offset == adr]
+      fmt = '0x%%0%dx' % (size / 4)
+      val_str = '= %s -> %s' % (fmt % old, fmt % new)
+      adr_str = ': %08x[%d:0]' % (adr, size - 1)
+      if not r_list:
+        clist.append([amap.name(adr) or '?', adr_str, val_str, ''])
+        continue
+      r = r_list[0]
+      clist.append(['%s.%s' % (p.name, r.name), adr_str, val_str, r.description])
+      # the changed fields
+      for entry in r.decode_plan():
+        if ((old ^ new) >> entry[2]) & entry[1]:
+          clist.append(decode_display(entry, new, old))
+    s = []
+    if clist:
+      s.append(util.display_cols(clist, [0,0,0,0]))
+    s.append('%d of %d registers differ' % (n, len(keys)))
+    return '\n'.join(s)
+
+  def snapshot_arg(self, ui, arg):
+    """return the snapshot for a diff argument (file, live or reset) - or None"""
+    if arg == 'live':
+      return self.snapshot()[0]
+    if arg == 'reset':
+      return self.reset_values()
+    try:
+      return load_snapshot(arg)
+    except IOError:
+      ui.put("can't read snapshot file '%s'\n" % arg)
+      return None
+
+  def cmd_snapshot(self, ui, args):
+    """save all peripheral registers to a file"""
+    if util.wrong_argc(ui, args, (1,)):
+      return
+    t_start = time.time()
+    (snap, n) = self.snapshot()
+    t = time.time() - t_start
+    save_snapshot(args[0], self.name, snap)
+    ui.put('%s: %d registers read in %d transactions (%.2f s)\n' % (args[0], len(snap), n, t))
+
+  def cmd_diff(self, ui, args):
+    """display register differences between snapshots"""
+    if util.wrong_argc(ui, args, (1,2)):
+      return
+    a = self.snapshot_arg(ui, args[0])
+    if a is None:
+      return
+    b = self.snapshot_arg(ui, (args + ['live',])[1])
+    if b is None:
+      return
+    ui.put('%s\n' % self.display_diff(a, b))
+
+  def cmd_watch(self, ui, args):
+    """watch peripheral registers for changes"""
+    hz = None
+    fname = None
+    names = []
+    args = list(args)
+    while args:
+      x = args.pop(0)
+      if x in ('-hz', '-o'):
+        if not args:
+          ui.put(util.bad_argc)
+          return
+        if x == '-hz':
+          hz = util.int_arg(ui, args.pop(0), (1, 1000000), 10)
+          if hz is None:
+            return
+        else:
+          fname = args.pop(0)
+      else:
+        names.append(x)
+    if len(names) < 1:
+      ui.put(util.bad_argc)
+      return
+    if not self.peripherals.has_key(names[0]):
+      ui.put("no peripheral named '%s' (run 'map' command for the names)\n" % names[0])
+      return
+    p = self.peripherals[names[0]]
+    if not p.registers:
+      ui.put('%s has no registers\n' % p.name)
+      return
+    if len(names) == 1:
+      # registers with read side effects are only read if they are named
+      r_list = [r for r in p.register_list() if r.readable() and r.readAction is None]
+    else:
+      r_list = []
+      for name in names[1:]:
+        if not p.registers.has_key(name):
+          ui.put("no register named '%s' (run 'regs %s' command for the names)\n" % (name, p.name))
+          return
+        r = p.registers[name]
+        if not r.readable():
+          ui.put('%s is write-only\n' % name)
+          return
+        r_list.append(r)
+    f = None
+    if fname is not None:
+      try:
+        f = open(fname, 'wb')
+      except IOError:
+        ui.put("can't open '%s'\n" % fname)
+        return
+    w = register_watch(ui, p, r_list, hz, f)
+    w.start()
+    ui.put('watching %d registers%s\nCtrl-D to exit\n' % (len(r_list), ('', ' (changes to %s)' % fname)[f is not None]))
+    ui.cli.ln.loop(w.poll, timeout = w.timeout())
+    if f is not None:
+      f.close()
+    ui.put('\n%s\n' % w.report())
+
   def cmd_regs(self, ui, args):
     """display peripheral registers"""
+    if len(args) >= 1 and args[0] == 'snapshot':
+      self.cmd_snapshot(ui, args[1:])
+      return
+    if len(args) >= 1 and args[0] == 'diff':
+      self.cmd_diff(ui, args[1:])
+      return
     if util.wrong_argc(ui, args, (1,2)):
       return
     if not self.peripherals.has_key(args[0]):
@@ -564,7 +1244,7 @@ def build_enumval(e, svd_e):
     e.enumval = {}
     for svd_ev in svd_e.enumeratedValue:
       ev = enumval()
-      ev.name = svd_ev.name
+      ev.name = intern_string(svd_ev.name)
       ev.description = description_cleanup(svd_ev.description)
       ev.value = svd_ev.value
       ev.isDefault = svd_ev.isDefault
@@ -573,7 +1253,15 @@ def build_enumval(e, svd_e):
       # store by value - that's the way we want to use it.
       e.enumval[ev.value] = ev
 
-def build_enumvals(f, svd_f):
+def enumvals_key(svd_e):
+  """return a key for the contents of an svd enumeratedValues"""
+  if svd_e.enumeratedValue is None:
+    evs = None
+  else:
+    evs = tuple([(ev.name, ev.description, ev.value, ev.isDefault) for ev in svd_e.enumeratedValue])
+  return ('enumvals', svd_e.name, svd_e.usage, evs)
+
+def build_enumvals(f, svd_f, defs):
   """build the enumvals for a field"""
   if svd_f.enumeratedValues is None:
     f.enumvals = None
@@ -582,15 +1270,20 @@ def build_enumvals(f, svd_f):
     # vendors don't have to name the enumvals, so we don't have a key
     f.enumvals = []
     for svd_e in svd_f.enumeratedValues:
-      e = enumvals()
-      e.name = svd_e.name
-      e.usage = svd_e.usage
-      build_enumval(e, svd_e)
-      # add it to the field
-      e.parent = f
+      # many fields have identical enumerations, share them
+      key = enumvals_key(svd_e)
+      e = defs.get(key)
+      if e is None:
+        e = enumvals()
+        e.name = intern_string(svd_e.name)
+        e.usage = intern_string(svd_e.usage)
+        build_enumval(e, svd_e)
+        # the parent is the first field using it
+        e.parent = f
+        defs[key] = e
       f.enumvals.append(e)
 
-def build_fields(r, svd_r):
+def build_fields(r, svd_r, defs):
   """build the fields for a register"""
   if svd_r.fields is None:
     r.fields = None
@@ -598,7 +1291,7 @@ def build_fields(r, svd_r):
     r.fields = {}
     for svd_f in svd_r.fields:
       f = field()
-      f.name = svd_f.name
+      f.name = intern_string(svd_f.name)
       f.description = description_cleanup(svd_f.description)
       # work out the bit range
       if svd_f.bitWidth is not None:
@@ -613,12 +1306,64 @@ def build_fields(r, svd_r):
         assert False, 'need to work out bit field for %s' % f.name
       f.msb = msb
       f.lsb = lsb
-      build_enumvals(f, svd_f)
+      build_enumvals(f, svd_f, defs)
       # add it to the register
       f.parent = r
       r.fields[f.name] = f
 
-def build_registers(p, svd_p):
+def register_access(svd_r):
+  """return the access for an svd register (from the fields if not given)"""
+  if svd_r.access is not None:
+    return intern_string(svd_r.access)
+  if svd_r.fields:
+    access = set([f.access for f in svd_r.fields])
+    if len(access) == 1:
+      return intern_string(access.pop())
+  return None
+
+def register_read_action(svd_r):
+  """return the read action for an svd register (or any of its fields)"""
+  if svd_r.readAction is not None:
+    return intern_string(svd_r.readAction)
+  if svd_r.fields:
+    for f in svd_r.fields:
+      if f.readAction is not None:
+        return intern_string(f.readAction)
+  return None
+
+def build_register(p, svd_r, name, offset, defs):
+  """build a register and add it to the peripheral"""
+  r = register()
+  r.name = intern_string(name)
+  r.size = (svd_r.size, p.default_register_size)[svd_r.size is None]
+  if r.size is None:
+    # still no size: default to 32 bits
+    r.size = 32
+  r.offset = offset
+  # The description and fields are built once and then shared by all the
+  # registers built from the same svd register (dim arrays, derived
+  # peripherals), or from the same svd fields (derived registers).
+  # The svd objects are kept in defs so their ids can't be re-used.
+  rdef = defs.get(id(svd_r))
+  if rdef is None:
+    r.description = description_cleanup(svd_r.description)
+    fdef = defs.get(id(svd_r.fields))
+    if fdef is None:
+      build_fields(r, svd_r, defs)
+      defs[id(svd_r.fields)] = (svd_r.fields, r.fields)
+    else:
+      r.fields = fdef[1]
+    r.access = register_access(svd_r)
+    r.readAction = register_read_action(svd_r)
+    r.resetValue = svd_r.resetValue
+    defs[id(svd_r)] = (svd_r, r.description, r.fields, r.access, r.readAction, r.resetValue)
+  else:
+    (_, r.description, r.fields, r.access, r.readAction, r.resetValue) = rdef
+  # add it to the device
+  r.parent = p
+  p.registers[r.name] = r
+
+def build_registers(p, svd_p, defs):
   """build the registers for a peripheral"""
   if svd_p.registers is None:
     p.registers = None
@@ -626,18 +1371,7 @@ def build_registers(p, svd_p):
     p.registers = {}
     for svd_r in svd_p.registers:
       if svd_r.dim is None:
-        r = register()
-        r.name = svd_r.name
-        r.description = description_cleanup(svd_r.description)
-        r.size = (svd_r.size, p.default_register_size)[svd_r.size is None]
-        if r.size is None:
-          # still no size: default to 32 bits
-          r.size = 32
-        r.offset = svd_r.addressOffset
-        build_fields(r, svd_r)
-        # add it to the device
-        r.parent = p
-        p.registers[r.name] = r
+        build_register(p, svd_r, svd_r.name, svd_r.addressOffset, defs)
       else:
         indices = build_indices(svd_r.dim, svd_r.dimIndex)
         # standard practice puts a "%s" in the name string. Is this always true?
@@ -645,54 +1379,59 @@ def build_registers(p, svd_p):
         # remove the [] from the name - we want to use the name as a python variable name
         svd_name = name_cleanup(svd_r.name)
         for i in range(svd_r.dim):
-          r = register()
-          r.name =  svd_name % indices[i]
-          r.description = description_cleanup(svd_r.description)
-          r.size = (svd_r.size, p.default_register_size)[svd_r.size is None]
-          if r.size is None:
-            # still no size: default to 32 bits
-            r.size = 32
-          r.offset = svd_r.addressOffset + (i * svd_r.dimIncrement)
-          build_fields(r, svd_r)
-          # add it to the device
-          r.parent = p
-          p.registers[r.name] = r
+          offset = svd_r.addressOffset + (i * svd_r.dimIncrement)
+          build_register(p, svd_r, svd_name % indices[i], offset, defs)
+
+def build_peripheral(d, svd_p, defs, parser=None):
+  """build a peripheral and add it to the device"""
+  p = peripheral()
+  p.name = intern_string(svd_p.name)
+  p.description = description_cleanup(svd_p.description)
+  p.address = svd_p.baseAddress
+  p.size = sizeof_address_blocks(svd_p.addressBlock, 'registers')
+  p.default_register_size = svd_p.size
+  if parser is None:
+    build_registers(p, svd_p, defs)
+  else:
+    # a stub, the registers are built on first use
+    p.lazy = (parser, svd_p, defs)
+  # add it to the device
+  p.parent = d
+  d.peripherals[p.name] = p
+  return p
 
 def build_peripherals(d, svd_device):
   """build the peripherals for a device"""
   d.peripherals = {}
+  # register definitions shared across the device
+  defs = {}
   for svd_p in svd_device.peripherals:
-    p = peripheral()
-    p.name = svd_p.name
-    p.description = description_cleanup(svd_p.description)
-    p.address = svd_p.baseAddress
-    p.size = sizeof_address_blocks(svd_p.addressBlock, 'registers')
-    p.default_register_size = svd_p.size
-    build_registers(p, svd_p)
-    # add it to the device
-    p.parent = d
-    d.peripherals[p.name] = p
+    build_peripheral(d, svd_p, defs)
+
+def build_peripheral_interrupts(d, svd_p):
+  """add the interrupts for a peripheral to the device interrupt table"""
+  if svd_p.interrupts is None:
+    return
+  for svd_i in svd_p.interrupts:
+    if not d.interrupts.has_key(svd_i.name):
+      # add the interrupt
+      i = interrupt()
+      i.name = intern_string(svd_i.name)
+      i.description = description_cleanup(svd_i.description)
+      i.irq = svd_i.value
+      # add it to the device
+      i.parent = d
+      d.interrupts[i.name] = i
+    else:
+      # already have this interrupt name
+      # should be the same irq number
+      assert d.interrupts[svd_i.name].irq == svd_i.value
 
 def build_interrupts(d, svd_device):
   """build the interrupt table for the device"""
   d.interrupts = {}
   for svd_p in svd_device.peripherals:
-    if svd_p.interrupts is None:
-      continue
-    for svd_i in svd_p.interrupts:
-      if not d.interrupts.has_key(svd_i.name):
-        # add the interrupt
-        i = interrupt()
-        i.name = svd_i.name
-        i.description = description_cleanup(svd_i.description)
-        i.irq = svd_i.value
-        # add it to the device
-        i.parent = d
-        d.interrupts[i.name] = i
-      else:
-        # already have this interrupt name
-        # should be the same irq number
-        assert d.interrupts[svd_i.name].irq == svd_i.value
+    build_peripheral_interrupts(d, svd_p)
 
 def build_cpu_info(d, svd_device):
   """build the cpu info"""
@@ -716,24 +1455,70 @@ def build_cpu_info(d, svd_device):
   c.parent = d
   d.cpu_info = c
 
-def build_device(svdpath):
-  """build the device structure from the svd file"""
-  # read and parse the svd file
-  svd_device = svd.parser(svdpath).parse()
-  d = device()
-  # general device information
+def build_header(d, svdpath, svd_device):
+  """build the general device information"""
   d.svdpath = svdpath
   d.vendor = svd_device.vendor
   d.name = svd_device.name
   d.description = description_cleanup(svd_device.description)
   d.series = svd_device.series
   d.version = svd_device.version
+
+def build_device(svdpath, stream=False, lazy=False):
+  """build the device structure from the svd file"""
+  if stream:
+    return build_device_stream(svdpath)
+  if lazy:
+    return build_device_lazy(svdpath)
+  # read and parse the svd file
+  svd_device = svd.parser(svdpath).parse()
+  d = device()
+  # general device information
+  build_header(d, svdpath, svd_device)
   # device sub components
   build_cpu_info(d, svd_device)
   build_peripherals(d, svd_device)
   build_interrupts(d, svd_device)
   return d
 
+def build_device_stream(svdpath):
+  """build the device structure from the svd file, one peripheral at a time"""
+  parser = svd.stream_parser(svdpath)
+  d = device()
+  d.peripherals = {}
+  d.interrupts = {}
+  for svd_p in parser.peripherals():
+    # The svd registers are released after each peripheral, so the register
+    # definitions can only be shared within a peripheral.
+    p = build_peripheral(d, svd_p, {})
+    if p.registers is None and svd_p.derived_from is not None:
+      # The svd registers of the base peripheral have been released.
+      # Share the registers we built for it.
+      base = d.peripherals[svd_p.derived_from.name]
+      if base.registers is not None:
+        p.registers = dict([(r.name, r.clone(p)) for r in base.registers.values()])
+    build_peripheral_interrupts(d, svd_p)
+  # the device header follows the peripherals
+  build_header(d, svdpath, parser.device)
+  build_cpu_info(d, parser.device)
+  return d
+
+def build_device_lazy(svdpath):
+  """build the device structure from the svd file, with stub peripherals"""
+  parser = svd.lazy_parser(svdpath)
+  svd_device = parser.parse()
+  d = device()
+  # general device information
+  build_header(d, svdpath, svd_device)
+  # device sub components
+  build_cpu_info(d, svd_device)
+  d.peripherals = {}
+  defs = {}
+  for svd_p in svd_device.peripherals:
+    build_peripheral(d, svd_p, defs, parser)
+  build_interrupts(d, svd_device)
+  return d
+
 # -----------------------------------------------------------------------------
 # make peripherals from tables
 
@@ -802,3 +1587,34 @@ def make_peripheral(name, address, size, register_set, description):
   return p
 
 # -----------------------------------------------------------------------------
+# memory usage
+
+def mem_usage(x):
+  """return a {type name: [count, bytes]} dictionary for the objects reachable from x"""
+  # don't count the code
+  skip = (types.ModuleType, types.TypeType, types.ClassType, types.FunctionType, types.BuiltinFunctionType, types.MethodType)
+  usage = {}
+  seen = set()
+  todo = [x,]
+  while todo:
+    x = todo.pop()
+    if id(x) in seen or isinstance(x, skip):
+      continue
+    seen.add(id(x))
+    size = sys.getsizeof(x)
+    # count the instance dictionary (if any) as part of the object
+    try:
+      d = object.__getattribute__(x, '__dict__')
+    except AttributeError:
+      d = None
+    if d is not None:
+      seen.add(id(d))
+      size += sys.getsizeof(d)
+      todo.extend(gc.get_referents(d))
+    u = usage.setdefault(type(x).__name__, [0, 0])
+    u[0] += 1
+    u[1] += size
+    todo.extend(gc.get_referents(x))
+  return usage
+
+# -----------------------------------------------------------------------------
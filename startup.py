@@ -0,0 +1,71 @@
+# -----------------------------------------------------------------------------
+"""
+
+Startup Profiling
+
+Record the time taken by the phases of pycs startup (imports, svd compile,
+fixups, usb enumeration, probe init, ...). Phases can be nested. The time
+of a phase that isn't spent in a nested phase is its "self" time.
+
+start('name') ... stop() brackets a phase. Call stop() from a finally clause so
+an exception in the phase doesn't leave it on the phase stack.
+
+"""
+# -----------------------------------------------------------------------------
+
+import time
+
+import util
+
+# -----------------------------------------------------------------------------
+
+# when this module was loaded (~ the start of the program)
+_t0 = time.time()
+
+# [name, depth, elapsed] in start order
+_phases = []
+# (phase index, start time) for the open phases
+_stack = []
+
+# -----------------------------------------------------------------------------
+
+def start(name):
+  """start a phase"""
+  _stack.append((len(_phases), time.time()))
+  _phases.append([name, len(_stack) - 1, None])
+
+def stop():
+  """stop the most recently started phase"""
+  (i, t) = _stack.pop()
+  _phases[i][2] = time.time() - t
+
+def self_time(i):
+  """return the time of phase i not spent in its nested phases"""
+  (name, depth, elapsed) = _phases[i]
+  t = elapsed
+  for (_, d, e) in _phases[i + 1:]:
+    if d <= depth:
+      break
+    if d == depth + 1:
+      t -= e
+  return t
+
+def report():
+  """return a string with the startup phase breakdown"""
+  total = time.time() - _t0
+  clist = [['phase', 'ms', 'self ms', '%'],]
+  accounted = 0.0
+  for (i, (name, depth, elapsed)) in enumerate(_phases):
+    if elapsed is None:
+      # not finished
+      continue
+    if depth == 0:
+      accounted += elapsed
+    st = self_time(i)
+    clist.append(['%s%s' % ('  ' * depth, name), '%.1f' % (elapsed * 1000.0), '%.1f' % (st * 1000.0), '%.1f' % (100.0 * elapsed / total)])
+  other = total - accounted
+  clist.append(['other', '%.1f' % (other * 1000.0), '%.1f' % (other * 1000.0), '%.1f' % (100.0 * other / total)])
+  clist.append(['total', '%.1f' % (total * 1000.0), '', ''])
+  return util.display_cols(clist)
+
+# -----------------------------------------------------------------------------
@@ -14,15 +14,28 @@ For the sake of the API we fake them with 8-bit operations.
 If the hardware needs a real 16-bit operation you will need to do
 it with a ram loaded library routine. (E.g. flash burning)
 
+8/16-bit buffer accesses within memory (sram, flash) are done with 32-bit
+accesses for the aligned part of the buffer. See wide_regions.
+
 """
 #------------------------------------------------------------------------------
 
+import os
+import sys
+import json
+import time
 import struct
+import collections
 from array import array as Array
 
 import usbdev
 import cortexm
 import iobuf
+import mem
+import calibrate
+import startup
+import devcache
+import util
 
 #------------------------------------------------------------------------------
 # supported devices
@@ -108,6 +121,111 @@ STLINK_SWIM_EXIT = 0x01
 STLINK_CORE_RUNNING = 0x80
 STLINK_CORE_HALTED  = 0x81
 
+# api v2 command status
+STLINK_DEBUG_ERR_OK    = 0x80
+STLINK_DEBUG_ERR_FAULT = 0x81
+
+#------------------------------------------------------------------------------
+# swd clock
+
+# (khz, divisor) fastest first
+swd_speeds = (
+  (4000, 0),
+  (1800, 1), # firmware default
+  (1200, 2),
+  (950, 3),
+  (480, 7),
+  (240, 15),
+  (125, 31),
+  (100, 40),
+  (50, 79),
+  (25, 158),
+  (15, 265),
+  (5, 798),
+)
+
+# the swd clock can be set with jtag firmware >= this version
+SWD_SET_FREQ_JTAG_V = 22
+
+# auto tuning starts at this rate and steps up
+AUTO_KHZ_MIN = 240
+# read/write/verify bursts per step
+AUTO_BURSTS = 3
+# words read in a burst (reads of a multiple of 16 words are slow)
+AUTO_WORDS = 255
+
+# the auto tuned rates are saved here: probe serial:target -> khz
+speed_file = os.path.join(devcache.cache_dir, 'stlink_speed.json')
+
+help_speed = (
+  ('<cr>', 'display the swd clock'),
+  ('<khz>', 'set the swd clock (the fastest supported rate <= khz)'),
+  ('auto', 'find and save the fastest reliable swd clock'),
+)
+
+def swd_speed(khz):
+  """return (khz, divisor) for the fastest supported swd clock <= khz"""
+  for (k, d) in swd_speeds:
+    if k <= khz:
+      return (k, d)
+  return swd_speeds[-1]
+
+def load_speeds():
+  """return the saved swd clocks"""
+  try:
+    f = open(speed_file, 'r')
+    speeds = json.load(f)
+    f.close()
+  except (IOError, ValueError):
+    return {}
+  return speeds
+
+def save_speed(key, khz):
+  """save the swd clock for a probe/target"""
+  speeds = load_speeds()
+  speeds[key] = khz
+  if not os.path.isdir(os.path.dirname(speed_file)):
+    os.makedirs(os.path.dirname(speed_file))
+  f = open(speed_file, 'w')
+  json.dump(speeds, f, indent=1, sort_keys=True)
+  f.close()
+
+#------------------------------------------------------------------------------
+# access planning for 8/16-bit buffers
+
+# Within these regions 8/16-bit buffer accesses are split into an 8-bit head,
+# a 32-bit aligned body and an 8-bit tail. The region meta is 'r' (reads only)
+# or 'rw' (reads and writes). Elsewhere (peripherals, bit-band aliases, system
+# space) the buffer access width is used.
+# The external memory window (0x60000000-0x9fffffff) is not included: it can
+# hold NAND registers (8-bit) or an LCD data port (16-bit). A target with ram
+# there can add it with itf['regions'].
+wide_regions = (
+  mem.region('code', 0x00000000, 0x20000000, 'r'),
+  mem.region('sram', 0x20000000, 0x02000000, 'rw'),
+  mem.region('sram_hi', 0x24000000, 0x1c000000, 'rw'),
+)
+
+def plan_access(regions, adr, n, mode):
+  """return a list of (width, adr, n) accesses for n bytes at adr"""
+  x = mem.region(None, adr, n)
+  for r in regions:
+    if mode in r.meta and x.adr >= r.adr and x.end <= r.end:
+      break
+  else:
+    return [(8, adr, n),]
+  head = min(-adr & 3, n)
+  body = (n - head) & ~3
+  tail = n - head - body
+  plan = []
+  if head:
+    plan.append((8, adr, head))
+  if body:
+    plan.append((32, adr + head, body >> 2))
+  if tail:
+    plan.append((8, adr + head + body, tail))
+  return plan
+
 #------------------------------------------------------------------------------
 # map register names to stlink register numbers
 
@@ -115,12 +233,30 @@ regmap = {
   'r0':0, 'r1':1, 'r2':2, 'r3':3, 'r4':4, 'r5':5, 'r6':6, 'r7':7,
   'r8':8, 'r9':9, 'r10':10, 'r11':11, 'r12':12, 'r13':13, 'r14':14, 'r15':15,
   'lr':14, 'pc':15, 'psr':16, 'msp':17, 'psp':18,
-  # primask
-  # faultmask
-  # basepri
-  # control
-  # 19 ?
-  # 20 ?
+  # 19 reserved
+  # 20 control/faultmask/basepri/primask
+}
+
+# the special registers are packed into register 20: name: bit shift
+SPECIAL_REG = 20
+special_regs = {'primask':0, 'basepri':8, 'faultmask':16, 'control':24}
+
+# the number of registers returned by a read of all registers
+NUM_REGS = 21
+
+# the size of the receive buffer (larger reads use a new buffer)
+RXBUF_SIZE = 8 << 10
+
+# memory commands in flight with the usb reader thread
+PIPELINE_DEPTH = 4
+
+# values per memory command (replaced by the calibrated sizes)
+default_chunks = {
+  'rd32': 0x5ff, # reads of more than 0x600 words fail
+  'rd32_avoid16': True, # reads that are a multiple of 16 words are slow
+  'wr32': 0x3fff, # limited by the 16-bit length field
+  'rd8': 0x3c, # 0..0x3c (ok), 0x3d..0x40 (slow), >= 0x41 (fails)
+  'wr8': 0x40, # 0..0x40 (ok), 0x41..0x54 (slow), >= 0x55 (fails)
 }
 
 #------------------------------------------------------------------------------
@@ -148,18 +284,25 @@ class stlink(object):
     self.sn = sn
     itf = itf_lookup(self.vid, self.pid)
     self.usb = usbdev.usbdev()
-    self.usb.open(self.vid, self.pid, interface=itf, serial=self.sn)
+    self.rxbuf = bytearray(RXBUF_SIZE)
+    startup.start('usb open')
+    try:
+      self.usb.open(self.vid, self.pid, interface=itf, serial=self.sn)
+    finally:
+      startup.stop()
     # get the interface information
     ver = self.get_version()
     assert ver['stlink_v'] == 2, 'only version 2 of stlink is supported'
+    self.jtag_v = ver['jtag_v']
     # set the api version
     self.api = ('v1', 'v2')[ver['jtag_v'] >= 11]
-    self.api = 'v1'
     # enter debug mode
     if self.get_current_mode() == 'dfu':
       self.leave_mode('dfu')
     if self.get_current_mode() != 'debug':
       self.enter_mode('swd')
+    # pipeline memory commands if usb reads can be kept in flight
+    self.depth = (1, PIPELINE_DEPTH)[self.usb.start_reader()]
 
   def __del__(self):
     if self.usb is not None:
@@ -177,6 +320,15 @@ class stlink(object):
       return self.usb.read_data(size)
     return None
 
+  def send_recv_into(self, data, size):
+    """send data, receive size bytes into the receive buffer (returned)"""
+    buf = self.rxbuf
+    if size > len(buf):
+      buf = bytearray(size)
+    self.usb.write_data(data)
+    self.usb.read_into(buf, size)
+    return buf
+
   def get_version(self):
     """return the ST-Link version"""
     x = self.send_recv(Array('B', (STLINK_GET_VERSION,)), 6)
@@ -196,19 +348,32 @@ class stlink(object):
     voltage = 2400 * reading / factor
     return voltage
 
+  def check_status(self, status, op):
+    """check the status byte of an api v2 command"""
+    assert status == STLINK_DEBUG_ERR_OK, '%s failed (status 0x%02x)' % (op, status)
+
   def get_status(self):
     """get the status"""
-    if self.api == 'v2':
-      x = self.rd_dbg32(cortexm.DCB_DHCSR)
-      if x & cortexm.S_HALT:
-        return 'halted'
-      elif x & cortexm.S_RESET_ST:
-        return 'reset'
-      else:
-        return 'running'
-    else:
-      x = self.send_recv(Array('B', (STLINK_DEBUG_COMMAND, STLINK_DEBUG_GETSTATUS)), 2)
-      return {STLINK_CORE_RUNNING:'running', STLINK_CORE_HALTED:'halted'}.get(x[0], None)
+    # the probe decodes the core state (a 2 byte reply, not a debug register read)
+    x = self.send_recv(Array('B', (STLINK_DEBUG_COMMAND, STLINK_DEBUG_GETSTATUS)), 2)
+    return {STLINK_CORE_RUNNING:'running', STLINK_CORE_HALTED:'halted'}.get(x[0], None)
+
+  def get_rw_status(self):
+    """return the status of the last memory read/write (api v2)"""
+    x = self.send_recv(Array('B', (STLINK_DEBUG_COMMAND, STLINK_DEBUG_APIV2_GETLASTRWSTATUS)), 2)
+    return x[0]
+
+  def has_swd_freq(self):
+    """return True if the firmware can set the swd clock"""
+    return self.jtag_v >= SWD_SET_FREQ_JTAG_V
+
+  def set_swd_freq(self, divisor):
+    """set the swd clock divisor"""
+    assert self.has_swd_freq()
+    cmd = Array('B', (STLINK_DEBUG_COMMAND, STLINK_DEBUG_APIV2_SWD_SET_FREQ))
+    append_u16(cmd, divisor)
+    x = self.send_recv(cmd, 2)
+    self.check_status(x[0], 'set swd clock')
 
   def get_core_id(self):
     """get the core id"""
@@ -276,14 +441,30 @@ class stlink(object):
       return read_u32(x)
     else:
       x = self.send_recv(cmd, 8)
+      self.check_status(x[0], 'read register')
       return read_u32(x[4:])
 
+  def rd_regs(self):
+    """read all the registers (NUM_REGS) with one command"""
+    x = (STLINK_DEBUG_APIV1_READALLREGS, STLINK_DEBUG_APIV2_READALLREGS)[self.api == 'v2']
+    cmd = Array('B', (STLINK_DEBUG_COMMAND, x))
+    nbytes = NUM_REGS * 4
+    if self.api == 'v1':
+      x = self.send_recv_into(cmd, nbytes)
+      return struct.unpack_from('<%dI' % NUM_REGS, x)
+    # api v2 has a 32-bit status before the registers
+    x = self.send_recv_into(cmd, nbytes + 4)
+    self.check_status(x[0], 'read all registers')
+    return struct.unpack_from('<%dI' % NUM_REGS, x, 4)
+
   def wr_reg(self, n, val):
     """write to a register"""
     x = (STLINK_DEBUG_APIV1_WRITEREG, STLINK_DEBUG_APIV2_WRITEREG)[self.api == 'v2']
     cmd = Array('B', (STLINK_DEBUG_COMMAND, x, n))
     append_u32(cmd, val)
-    self.send_recv(cmd, 2)
+    x = self.send_recv(cmd, 2)
+    if self.api == 'v2':
+      self.check_status(x[0], 'write register')
 
   def rd_dbg32(self, adr):
     """read a 32-bit memory mapped debug register"""
@@ -291,6 +472,7 @@ class stlink(object):
     cmd = Array('B', (STLINK_DEBUG_COMMAND, STLINK_DEBUG_APIV2_READDEBUGREG))
     append_u32(cmd, adr)
     x = self.send_recv(cmd, 8)
+    self.check_status(x[0], 'read debug register')
     return read_u32(x[4:])
 
   def wr_dbg32(self, adr, val):
@@ -299,32 +481,74 @@ class stlink(object):
     cmd = Array('B', (STLINK_DEBUG_COMMAND, x))
     append_u32(cmd, adr)
     append_u32(cmd, val)
-    self.send_recv(cmd, 2)
+    x = self.send_recv(cmd, 2)
+    if self.api == 'v2':
+      self.check_status(x[0], 'write debug register')
 
-  def rd_mem32(self, adr, n):
-    """read n 32-bit values from memory region"""
+  def rd_mem32_cmd(self, adr, n):
+    """return the command to read n 32-bit values from memory"""
     assert adr & 3 == 0
-    nbytes = 4 * n
     cmd = Array('B', (STLINK_DEBUG_COMMAND, STLINK_DEBUG_READMEM_32BIT))
     append_u32(cmd, adr)
-    append_u16(cmd, nbytes)
-    x = self.send_recv(cmd, nbytes)
-    return [read_u32(x[i:i+4]) for i in xrange(0, nbytes, 4)]
+    append_u16(cmd, 4 * n)
+    return cmd
 
-  def wr_mem32(self, adr, buf):
-    """write 32-bit buffer to memory address"""
+  def rd_mem32(self, adr, n):
+    """read n 32-bit values from memory region"""
+    x = self.send_recv_into(self.rd_mem32_cmd(adr, n), 4 * n)
+    return struct.unpack_from('<%dI' % n, x)
+
+  def rd_mem32_chunks(self, chunks):
+    """read a list of (adr, n) 32-bit memory chunks, yield the values for each chunk"""
+    # keep up to depth read commands in flight
+    inflight = collections.deque()
+    try:
+      for (adr, n) in chunks:
+        if len(inflight) == self.depth:
+          n_rd = inflight.popleft()
+          self.usb.read_into(self.rxbuf, 4 * n_rd)
+          yield struct.unpack_from('<%dI' % n_rd, self.rxbuf)
+        self.usb.write_data(self.rd_mem32_cmd(adr, n))
+        inflight.append(n)
+      while inflight:
+        n_rd = inflight.popleft()
+        self.usb.read_into(self.rxbuf, 4 * n_rd)
+        yield struct.unpack_from('<%dI' % n_rd, self.rxbuf)
+    except GeneratorExit:
+      # abandoned: read the replies in flight, keep the usb stream in sync
+      while inflight:
+        self.usb.read_into(self.rxbuf, 4 * inflight.popleft())
+      raise
+
+  def wr_mem32_send(self, adr, buf):
+    """send a 32-bit memory write, return the number of status replies to be read"""
     assert adr & 3 == 0
-    # convert the 32-bit buffer to a array of bytes
-    buf = iobuf.data_buffer(32, buf)
-    buf.convert(8, 'le')
-    buf = Array('B', buf.buf)
+    # the 32-bit array is written as little endian bytes
+    buf = Array('I', buf)
+    if sys.byteorder == 'big':
+      buf.byteswap()
     # build the command
     cmd = Array('B', (STLINK_DEBUG_COMMAND, STLINK_DEBUG_WRITEMEM_32BIT))
     append_u32(cmd, adr)
-    append_u16(cmd, len(buf))
+    append_u16(cmd, len(buf) * 4)
     # send the command and buffer
     self.send_recv(cmd, 0)
     self.send_recv(buf, 0)
+    if self.api == 'v2':
+      # the write has no reply, so ask for the status
+      self.send_recv(Array('B', (STLINK_DEBUG_COMMAND, STLINK_DEBUG_APIV2_GETLASTRWSTATUS)), 0)
+      return 1
+    return 0
+
+  def wr_mem32_status(self):
+    """read and check the status reply for a 32-bit memory write"""
+    self.usb.read_into(self.rxbuf, 2)
+    self.check_status(self.rxbuf[0], 'write memory')
+
+  def wr_mem32(self, adr, buf):
+    """write 32-bit buffer to memory address"""
+    if self.wr_mem32_send(adr, buf):
+      self.wr_mem32_status()
 
   def rd_mem8(self, adr, n):
     """read n 8-bit values from memory region"""
@@ -336,8 +560,8 @@ class stlink(object):
     nread = n
     if nread == 1:
       nread += 1
-    x = self.send_recv(cmd, nread)
-    return [x[i] for i in xrange(n)]
+    x = self.send_recv_into(cmd, nread)
+    return struct.unpack_from('%dB' % n, x)
 
   def wr_mem8(self, adr, buf):
     """write 8 bit buffer to memory address"""
@@ -350,11 +574,14 @@ class stlink(object):
     # send the command and buffer
     self.send_recv(cmd, 0)
     self.send_recv(buf, 0)
+    if self.api == 'v2':
+      self.check_status(self.get_rw_status(), 'write memory')
 
   def __str__(self):
     """return a string for basic device description"""
     s = []
     s.append('ST-Link usb %04x:%04x serial %r' % (self.vid, self.pid, self.sn))
+    s.append('jtag firmware v%d api %s' % (self.jtag_v, self.api))
     s.append('target voltage %.3fV' % (float(self.get_voltage()) / 1000.0))
     return '\n'.join(s)
 
@@ -363,26 +590,45 @@ class stlink(object):
 class dbgio(object):
   """ST-Link implementation of dbgio cpu interface"""
 
-  def __init__(self, vid=None, pid=None, idx=None, sn=None):
+  def __init__(self, vid=None, pid=None, idx=None, sn=None, target=None, max_khz=None, regions=None):
     """no actual operations, record the selected usb device"""
     self.vid = vid
     self.pid = pid
     self.idx = idx
     self.sn = sn
+    self.target = target
+    self.max_khz = max_khz
+    # regions where 8/16-bit buffers may use 32-bit accesses
+    self.regions = (regions, wide_regions)[regions is None]
+    self.chunks = dict(default_chunks)
+    self.khz = None
     self.cpu_name = None
     self.itf = None
     self.menu = (
       ('info', self.cmd_info),
+      ('calibrate', self.cmd_calibrate, calibrate.help_calibrate),
+      ('speed', self.cmd_speed, help_speed),
     )
 
   def connect(self, cpu_name, itf):
     """connect the debugger to the target"""
     self.cpu_name = cpu_name
     self.dbg_itf = itf
-    self.stlink = stlink(self.vid, self.pid, self.sn)
-    vref = self.stlink.get_voltage()
+    startup.start('probe init')
+    try:
+      self.stlink = stlink(self.vid, self.pid, self.sn)
+      vref = self.stlink.get_voltage()
+    finally:
+      startup.stop()
     # check VREF
     assert vref > 1500, 'Vref is too low. Check target power.'
+    # start with the saved (auto tuned) swd clock
+    if self.stlink.has_swd_freq():
+      khz = load_speeds().get(self.speed_key(), self.max_khz)
+      if khz is not None:
+        self.set_speed(khz)
+    # use the calibrated chunk sizes for this probe
+    self.chunks.update(calibrate.load_chunks(self.chunk_key()))
 
   def disconnect(self):
     """disconnect the debugger from the target"""
@@ -396,6 +642,140 @@ class dbgio(object):
     """display stlink information"""
     ui.put('%s\n' % self)
 
+  def chunk_key(self):
+    """return the key for the calibrated chunk sizes (probe model and firmware)"""
+    return 'stlink %04x:%04x jtag v%d' % (self.vid, self.pid, self.stlink.jtag_v)
+
+  def cmd_calibrate(self, ui, args):
+    """measure and save the memory transfer chunk sizes"""
+    def rd32(adr, nvals, n):
+      self.chunks['rd32'] = n
+      self.chunks['rd32_avoid16'] = False
+      for vals in self.stlink.rd_mem32_chunks(self.rd32_chunks(adr, nvals)):
+        pass
+    def wr32(adr, nvals, n):
+      self.chunks['wr32'] = n
+      self.wr32_words(adr, nvals, lambda: 0)
+    def rd8(adr, nvals, n):
+      self.chunks['rd8'] = n
+      self.rdmem8_cmds(adr, nvals, iobuf.data_buffer(8))
+    def wr8(adr, nvals, n):
+      self.chunks['wr8'] = n
+      self.wrmem8_cmds(adr, nvals, iobuf.data_buffer(8, [0] * nvals))
+    tests = (
+      ('rd32', rd32, (0x40, 0xff, 0x100, 0x1ff, 0x200, 0x3ff, 0x400, 0x5ff), 32, default_chunks['rd32']),
+      ('wr32', wr32, (0x100, 0x400, 0x800, 0x1000, 0x2000, 0x3fff), 32, default_chunks['wr32']),
+      ('rd8', rd8, (0x10, 0x20, 0x3c), 8, default_chunks['rd8']),
+      ('wr8', wr8, (0x10, 0x20, 0x40), 8, default_chunks['wr8']),
+    )
+    # the tests use the real transfer loops, put back the chunks if they fail
+    save = dict(self.chunks)
+    chunks = None
+    try:
+      chunks = calibrate.calibrate(ui, args, self, tests, (AssertionError, usbdev.usbdev_error))
+    finally:
+      self.chunks = save
+    if chunks is None:
+      return
+    chunks = dict([(k, chunks[k]) for k in default_chunks.keys()])
+    self.chunks.update(chunks)
+    calibrate.save_chunks(self.chunk_key(), chunks)
+    ui.put('%s (saved for %s)\n' % (self.chunk_str(), self.chunk_key()))
+
+  def chunk_str(self):
+    """return a string for the chunk sizes"""
+    s = ['%s %d' % (k, self.chunks[k]) for k in ('rd32', 'wr32', 'rd8', 'wr8')]
+    if self.chunks['rd32_avoid16']:
+      s.append('avoid rd32 multiples of 16')
+    return ', '.join(s)
+
+  def speed_key(self):
+    """return the key for the saved swd clock"""
+    # older stlink serial numbers are binary
+    return '%s:%s' % (str(self.sn).encode('hex'), self.target)
+
+  def set_speed(self, khz):
+    """set the swd clock, return the actual rate in khz"""
+    if self.max_khz is not None:
+      khz = min(khz, self.max_khz)
+    (khz, divisor) = swd_speed(khz)
+    self.stlink.set_swd_freq(divisor)
+    self.khz = khz
+    return khz
+
+  def speed_test(self, ref):
+    """run a read/write/verify burst, return True if it passes"""
+    # at a marginal clock the failure is often a usb timeout
+    errors = (AssertionError, usbdev.usbdev_error)
+    try:
+      # DCRDR is a scratch register for the debugger
+      save = self.stlink.rd_mem32(cortexm.DCB_DCRDR, 1)[0]
+    except errors:
+      return False
+    try:
+      for x in (0x00000000, 0xffffffff, 0xaaaaaaaa, 0x55555555, 0x12345678):
+        self.stlink.wr_mem32(cortexm.DCB_DCRDR, (x,))
+        if self.stlink.rd_mem32(cortexm.DCB_DCRDR, 1)[0] != x:
+          return False
+      # read a block and compare with the reference read
+      return self.stlink.rd_mem32(0, AUTO_WORDS) == ref
+    except errors:
+      return False
+    finally:
+      try:
+        self.stlink.wr_mem32(cortexm.DCB_DCRDR, (save,))
+      except errors:
+        # the link has failed at this clock, auto_speed will step back down
+        pass
+
+  def auto_speed(self, ui):
+    """find the fastest reliable swd clock, return the rate in khz"""
+    # step up from a safe rate
+    speeds = [k for (k, d) in reversed(swd_speeds) if k >= AUTO_KHZ_MIN]
+    if self.max_khz is not None:
+      speeds = [k for k in speeds if k <= self.max_khz] or [swd_speed(self.max_khz)[0],]
+    self.set_speed(speeds[0])
+    # reference read of the vector table at the slowest rate
+    ref = self.stlink.rd_mem32(0, AUTO_WORDS)
+    best = None
+    for khz in speeds:
+      self.set_speed(khz)
+      t_start = time.time()
+      ok = True
+      for i in xrange(AUTO_BURSTS):
+        ok = ok and self.speed_test(ref)
+      ui.put('%5d kHz: %s (%.1f ms)\n' % (khz, ('fail', 'ok')[ok], (time.time() - t_start) * 1000.0))
+      if not ok:
+        break
+      best = khz
+    if best is None:
+      best = speeds[0]
+    self.set_speed(best)
+    return best
+
+  def cmd_speed(self, ui, args):
+    """display/set the swd clock"""
+    if util.wrong_argc(ui, args, (0, 1)):
+      return
+    if not self.stlink.has_swd_freq():
+      ui.put('stlink jtag firmware v%d can not set the swd clock (needs v%d)\n' % (self.stlink.jtag_v, SWD_SET_FREQ_JTAG_V))
+      return
+    if len(args) == 0:
+      if self.khz is None:
+        ui.put('swd clock %d kHz (firmware default)\n' % swd_speeds[1][0])
+      else:
+        ui.put('swd clock %d kHz\n' % self.khz)
+      return
+    if args[0] == 'auto':
+      khz = self.auto_speed(ui)
+      save_speed(self.speed_key(), khz)
+      ui.put('swd clock %d kHz (saved for %s)\n' % (khz, self.target))
+      return
+    khz = util.int_arg(ui, args[0], (1, 100000), 10)
+    if khz is None:
+      return
+    ui.put('swd clock %d kHz\n' % self.set_speed(khz))
+
   def is_halted(self):
     """return True if target is halted"""
     return self.stlink.get_status() == 'halted'
@@ -414,29 +794,58 @@ class dbgio(object):
 
   def rdreg(self, reg):
     """read from the named register"""
+    if special_regs.has_key(reg):
+      return (self.stlink.rd_reg(SPECIAL_REG) >> special_regs[reg]) & 0xff
     n = regmap.get(reg, None)
     if n is None:
       return None
     return self.stlink.rd_reg(n)
 
+  def rdregs(self, regs):
+    """read a list of named registers, return a list of values (None if unknown)"""
+    vals = self.stlink.rd_regs()
+    l = []
+    for reg in regs:
+      if special_regs.has_key(reg):
+        l.append((vals[SPECIAL_REG] >> special_regs[reg]) & 0xff)
+      elif regmap.has_key(reg):
+        l.append(vals[regmap[reg]])
+      else:
+        l.append(None)
+    return l
+
   def wrreg(self, reg, val):
     """write to the named register"""
+    if special_regs.has_key(reg):
+      # read-modify-write the packed special registers
+      shift = special_regs[reg]
+      x = self.stlink.rd_reg(SPECIAL_REG) & ~(0xff << shift)
+      self.stlink.wr_reg(SPECIAL_REG, x | ((val & 0xff) << shift))
+      return
     n = regmap.get(reg, None)
     if n is None:
       return
     self.stlink.wr_reg(n, val)
 
-  def rdmem32(self, adr, n, io):
-    """read n 32-bit words from memory starting at adr"""
-    max_n = 0x5ff
+  def rd32_chunks(self, adr, n):
+    """return the (adr, n) read commands for n 32-bit words starting at adr"""
+    max_n = self.chunks['rd32']
+    avoid16 = self.chunks['rd32_avoid16']
+    chunks = []
     while n > 0:
       nread = (n, max_n)[n >= max_n]
       # avoid reads that are a multiple of 16 x 32-bit, they are slow
-      if nread & 15 == 0:
+      if avoid16 and nread & 15 == 0:
         nread -= 1
-      [io.wr32(x) for x in self.stlink.rd_mem32(adr, nread)]
+      chunks.append((adr, nread))
       n -= nread
       adr += nread * 4
+    return chunks
+
+  def rdmem32(self, adr, n, io):
+    """read n 32-bit words from memory starting at adr"""
+    for vals in self.stlink.rd_mem32_chunks(self.rd32_chunks(adr, n)):
+      [io.wr32(x) for x in vals]
 
   def rdmem16(self, adr, n, io):
     """read n 16-bit words from memory starting at adr"""
@@ -448,8 +857,17 @@ class dbgio(object):
 
   def rdmem8(self, adr, n, io):
     """read n 8-bit words from memory starting at adr"""
-    # n = 0..0x3c (ok), 0x3d..0x40 (slow), >= 0x41 (fails)
-    max_n = 0x3c
+    for (width, adr, n) in plan_access(self.regions, adr, n, 'r'):
+      if width == 32:
+        # 32-bit aligned body, little endian bytes
+        for vals in self.stlink.rd_mem32_chunks(self.rd32_chunks(adr, n)):
+          [io.wr8(x) for x in struct.unpack('%dB' % (len(vals) * 4), struct.pack('<%dI' % len(vals), *vals))]
+      else:
+        self.rdmem8_cmds(adr, n, io)
+
+  def rdmem8_cmds(self, adr, n, io):
+    """read n 8-bit words from memory starting at adr with 8-bit reads"""
+    max_n = self.chunks['rd8']
     while n > 0:
       nread = (n, max_n)[n >= max_n]
       [io.wr8(x) for x in self.stlink.rd_mem8(adr, nread)]
@@ -469,13 +887,24 @@ class dbgio(object):
 
   def wrmem32(self, adr, n, io):
     """write n 32-bit words to memory starting at adr"""
-    # maximum write length is limited by the 16-bit length field
-    max_n = 0x3fff
+    self.wr32_words(adr, n, io.rd32)
+
+  def wr32_words(self, adr, n, rd32):
+    """write n 32-bit words (from the rd32 function) to memory starting at adr"""
+    max_n = self.chunks['wr32']
+    # the write status replies are checked up to depth writes later
+    inflight = 0
     while n > 0:
       nwrite = (n, max_n)[n >= max_n]
-      self.stlink.wr_mem32(adr, [io.rd32() for i in xrange(nwrite)])
+      inflight += self.stlink.wr_mem32_send(adr, [rd32() for i in xrange(nwrite)])
+      if inflight == self.stlink.depth:
+        self.stlink.wr_mem32_status()
+        inflight -= 1
       n -= nwrite
       adr += nwrite * 4
+    while inflight > 0:
+      self.stlink.wr_mem32_status()
+      inflight -= 1
 
   def wrmem16(self, adr, n, io):
     """write n 16-bit words to memory starting at adr"""
@@ -487,8 +916,17 @@ class dbgio(object):
 
   def wrmem8(self, adr, n, io):
     """write n 8-bit words to memory starting at adr"""
-    # n = 0..0x40 (ok), 0x41..0x54 (slow), >= 0x55 (fails)
-    max_n = 0x40
+    for (width, adr, n) in plan_access(self.regions, adr, n, 'w'):
+      if width == 32:
+        # 32-bit aligned body from little endian bytes
+        rd8 = io.rd8
+        self.wr32_words(adr, n, lambda: rd8() | (rd8() << 8) | (rd8() << 16) | (rd8() << 24))
+      else:
+        self.wrmem8_cmds(adr, n, io)
+
+  def wrmem8_cmds(self, adr, n, io):
+    """write n 8-bit words to memory starting at adr with 8-bit writes"""
+    max_n = self.chunks['wr8']
     while n > 0:
       nwrite = (n, max_n)[n >= max_n]
       self.stlink.wr_mem8(adr, [io.rd8() for i in xrange(nwrite)])
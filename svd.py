@@ -6,23 +6,100 @@ Convert an *.svd file to a python objects representing the device.
 """
 # -----------------------------------------------------------------------------
 
+import os
+import sys
+import gzip
 import lxml.etree as ET
 
 # -----------------------------------------------------------------------------
 
 def set_derived_from(x, thing):
-  """setup derived_from links between svd objects"""
+  """setup derived_from links between sibling svd objects"""
   if x is None:
     return
+  # index the siblings by name, a later duplicate name wins
+  names = {}
+  for e in x:
+    names[e.name] = e
   for e in x:
     if e.derivedFrom:
-      for df in x:
-        if e.derivedFrom == df.name:
-          e.derived_from = df
-          #print('%s %s is derived from %s' % (thing, e.name, e.derived_from.name))
+      df = names.get(e.derivedFrom)
+      if df is not None:
+        e.derived_from = df
+        #print('%s %s is derived from %s' % (thing, e.name, e.derived_from.name))
     else:
       e.derived_from = None
 
+def scoped_objects(peripherals):
+  """generate (scope, object) for the derivable objects of a peripheral list"""
+  for p in peripherals:
+    yield ((), p)
+    for r in p.__dict__.get('registers', ()):
+      yield ((p.name,), r)
+      for f in r.__dict__.get('fields', ()):
+        yield ((p.name, r.name), f)
+        for e in f.__dict__.get('enumeratedValues', ()):
+          yield ((p.name, r.name, f.name), e)
+
+def flatten(x, done):
+  """copy the attributes inherited through the derived_from chain into x"""
+  if id(x) in done:
+    return
+  done.add(id(x))
+  base = x.derived_from
+  if base is None:
+    return
+  flatten(base, done)
+  for (name, value) in base.__dict__.iteritems():
+    if name not in x.__dict__:
+      x.__dict__[name] = value
+
+def new_paths():
+  """return empty dotted path indexes, one per level (peripheral, register, field, enums)"""
+  return ({}, {}, {}, {})
+
+def index_objects(objects, paths):
+  """add (scope, object) to the dotted path indexes"""
+  for (scope, x) in objects:
+    if x.name is not None:
+      paths[len(scope)]['.'.join(scope + (x.name,))] = x
+
+def resolve_derived_from(peripherals, paths=None):
+  """
+  Resolve the derivedFrom references for a list of peripherals.
+  Sibling references have already been linked by set_derived_from.
+  Others are looked up as a dotted path (E.g. PERIPH.REG.FIELD),
+  first relative to the scope of the object and then globally.
+  paths indexes the (flattened) objects of other peripherals, the objects
+  of the list are added to it.
+  Each object then gets a copy of the attributes it inherits, so
+  reading them is a plain attribute lookup.
+  Return a list of (dotted path, derivedFrom) for the unresolved references.
+  """
+  if peripherals is None:
+    return []
+  objects = list(scoped_objects(peripherals))
+  # an object can only be derived from the same kind of object
+  if paths is None:
+    paths = new_paths()
+  index_objects(objects, paths)
+  # link the references that aren't to a sibling
+  unresolved = []
+  for (scope, x) in objects:
+    if x.derivedFrom and x.derived_from is None:
+      for i in range(len(scope), -1, -1):
+        df = paths[len(scope)].get('.'.join(scope[:i] + (x.derivedFrom,)))
+        if df is not None and df is not x:
+          x.derived_from = df
+          break
+      else:
+        unresolved.append(('.'.join(scope + (x.name,)), x.derivedFrom))
+  # copy the inherited attributes
+  done = set()
+  for (scope, x) in objects:
+    flatten(x, done)
+  return unresolved
+
 class svd_object(object):
 
   def __init__(self):
@@ -38,14 +115,12 @@ class svd_object(object):
       self.__setattr__(name, l)
 
   def __getattr__(self, name):
-    if name == 'derived_from':
-      # no defined derived_from attribute
-      return None
-    if self.derived_from is None:
-      # the derived_from goes nowhere
-      return None
-    # try to find the attribute in the next "derived from" link
-    return getattr(self.derived_from, name)
+    if name.startswith('__'):
+      # don't hide the python internals
+      raise AttributeError(name)
+    # Not defined by this object. Inherited attributes are copied in by
+    # resolve_derived_from, so there is no need to look any further.
+    return None
 
   def attribute_string(self, s, name):
     if self.__dict__.has_key(name):
@@ -80,201 +155,467 @@ class svd_object(object):
 # xs:boolean = boolean
 # scaledNonNegativeInteger = integer
 
-def get_string(node, tag, default=None):
-  """Get the text string for the tag from the node"""
-  try:
-    return node.find(tag).text
-  except AttributeError:
-    return default
+def to_string(text):
+  return text
 
-def get_integer(node, tag, default=None):
-  text_value = get_string(node, tag, default)
+def to_integer(text):
+  if text is None:
+    return None
   try:
-    if text_value != default:
-      text_value = text_value.strip().lower()
-      if text_value.startswith('0x'):
-        return int(text_value[2:], 16)  # hexadecimal
-      elif text_value.startswith('#'):
-        # TODO(posborne): Deal with strange #1xx case better
-        #
-        # Freescale will sometimes provide values that look like this:
-        #   #1xx
-        # In this case, there are a number of values which all mean the
-        # same thing as the field is a "don't care".  For now, we just
-        # replace those bits with zeros.
-        text_value = text_value.replace('x', '0')[1:]
-        is_bin = all(x in '01' for x in text_value)
-        return int(text_value, 2) if is_bin else int(text_value)  # binary
-      elif text_value.startswith('true'):
-        return 1
-      elif text_value.startswith('false'):
-        return 0
-      else:
-        return int(text_value)  # decimal
+    text = text.strip().lower()
+    if text.startswith('0x'):
+      return int(text[2:], 16)  # hexadecimal
+    elif text.startswith('#'):
+      # TODO(posborne): Deal with strange #1xx case better
+      #
+      # Freescale will sometimes provide values that look like this:
+      #   #1xx
+      # In this case, there are a number of values which all mean the
+      # same thing as the field is a "don't care".  For now, we just
+      # replace those bits with zeros.
+      text = text.replace('x', '0')[1:]
+      is_bin = all(x in '01' for x in text)
+      return int(text, 2) if is_bin else int(text)  # binary
+    elif text.startswith('true'):
+      return 1
+    elif text.startswith('false'):
+      return 0
+    else:
+      return int(text)  # decimal
   except ValueError:
-    return default
-  return default
+    return None
 
-def get_boolean(node, tag, default=None):
-  n = get_integer(node, tag, default)
+def to_boolean(text):
+  n = to_integer(text)
   if n is None:
-    return default
+    return None
   return n != 0
 
 # -----------------------------------------------------------------------------
-
-def string_node(node, tag, default=None):
-  return (tag, get_string(node, tag, default))
-
-def boolean_node(node, tag, default=None):
-  return (tag, get_boolean(node, tag, default))
-
-def integer_node(node, tag, default=None):
-  return (tag, get_integer(node, tag, default))
+# Decode tables: tag -> converter for the values of each element type.
+
+enumvalue_tags = {
+  'name': to_string,
+  'description': to_string,
+  'value': to_integer,
+  'isDefault': to_boolean,
+}
+
+enumvalues_tags = {
+  'name': to_string,
+  'usage': to_string,
+}
+
+field_tags = {
+  'name': to_string,
+  'description': to_string,
+  'access': to_string,
+  'bitOffset': to_integer,
+  'bitWidth': to_integer,
+  'lsb': to_integer,
+  'msb': to_integer,
+  'bitRange': to_string,
+  'readAction': to_string,
+}
+
+register_tags = {
+  'dim': to_integer,
+  'dimIncrement': to_integer,
+  'dimIndex': to_string,
+  'name': to_string,
+  'displayName': to_string,
+  'description': to_string,
+  'alternateGroup': to_string,
+  'alternateRegister': to_string,
+  'addressOffset': to_integer,
+  'size': to_integer,
+  'access': to_string,
+  'protection': to_string,
+  'resetValue': to_integer,
+  'resetMask': to_integer,
+  'dataType': to_string,
+  'modifiedWriteValues': to_string,
+  #<xs:element name="writeConstraint" type="writeConstraintType" minOccurs="0"/>
+  'readAction': to_string,
+}
+
+address_block_tags = {
+  'offset': to_integer,
+  'size': to_integer,
+  'usage': to_string,
+}
+
+interrupt_tags = {
+  'name': to_string,
+  'description': to_string,
+  'value': to_integer,
+}
+
+peripheral_tags = {
+  'name': to_string,
+  'version': to_string,
+  'description': to_string,
+  'alternatePeripheral': to_string,
+  'groupName': to_string,
+  'prependToName': to_string,
+  'appendToName': to_string,
+  'headerStructName': to_string,
+  'disableCondition': to_string,
+  'baseAddress': to_integer,
+  'size': to_integer, # default register size
+}
+
+cpu_tags = {
+  'name': to_string,
+  'revision': to_string,
+  'endian': to_string,
+  'mpuPresent': to_boolean,
+  'fpuPresent': to_boolean,
+  'fpuDP': to_boolean,
+  'icachePresent': to_boolean,
+  'dcachePresent': to_boolean,
+  'itcmPresent': to_boolean,
+  'dtcmPresent': to_boolean,
+  'vtorPresent': to_boolean,
+  'nvicPrioBits': to_integer,
+  'vendorSystickConfig': to_boolean,
+  'deviceNumInterrupts': to_integer,
+  'sauNumRegions': to_integer,
+  #<xs:element name="sauRegionsConfig" minOccurs="0">
+}
+
+device_tags = {
+  'vendor': to_string,
+  'vendorID': to_string,
+  'name': to_string,
+  'series': to_string,
+  'version': to_string,
+  'description': to_string,
+  'licenseText': to_string,
+  'headerSystemFilename': to_string,
+  'headerDefinitionsPrefix': to_string,
+  'addressUnitBits': to_integer,
+  'width': to_integer,
+}
+
+# Sub-element tables: tag -> (list attribute name, parser method).
+# The method returns a list of objects to add to the list attribute.
+
+enumvalues_lists = {
+  'enumeratedValue': ('enumeratedValue', 'get_enumvalue_list'),
+}
+
+field_lists = {
+  'enumeratedValues': ('enumeratedValues', 'get_enumvalues_list'),
+}
+
+register_lists = {
+  'fields': ('fields', 'get_fields'),
+}
+
+peripheral_lists = {
+  'addressBlock': ('addressBlock', 'get_address_block_list'),
+  'interrupt': ('interrupts', 'get_interrupt_list'),
+  'registers': ('registers', 'get_registers'),
+}
+
+# the peripheral without the registers
+peripheral_header_lists = {
+  'addressBlock': ('addressBlock', 'get_address_block_list'),
+  'interrupt': ('interrupts', 'get_interrupt_list'),
+}
+
+device_lists = {
+  'peripherals': ('peripherals', 'get_peripherals'),
+}
 
 # -----------------------------------------------------------------------------
 
 class parser(object):
 
   def __init__(self, path):
+    self.path = path
     self.tree = ET.parse(path)
     self.root = self.tree.getroot()
+    # the unresolved references that have been reported
+    self.reported = set()
+
+  def report_unresolved(self, unresolved):
+    """warn about derivedFrom references that weren't found"""
+    for (path, df) in unresolved:
+      if (path, df) not in self.reported:
+        self.reported.add((path, df))
+        sys.stderr.write('%s: %s is derived from %s, which is not defined\n' % (os.path.basename(self.path), path, df))
+
+  def decode(self, node, tags, lists=None):
+    """
+    Decode the child elements of a node in a single pass.
+    Values use the first occurrence of a tag, sub-element lists accumulate.
+    """
+    x = svd_object()
+    values = {}
+    items = None
+    for child in node:
+      tag = child.tag
+      convert = tags.get(tag)
+      if convert is not None:
+        if tag not in values:
+          values[tag] = convert(child.text)
+      elif lists is not None and tag in lists:
+        (name, method) = lists[tag]
+        if items is None:
+          items = {}
+        items.setdefault(name, []).extend(getattr(self, method)(child))
+    for (tag, value) in values.iteritems():
+      if value is not None:
+        x.__dict__[tag] = value
+    if items is not None:
+      for (name, l) in items.iteritems():
+        x.list_attribute(l, name)
+    return x
 
   def get_enumvalue(self, node):
-    e = svd_object()
-    e.attribute(string_node(node, 'name'))
-    e.attribute(string_node(node, 'description'))
-    e.attribute(integer_node(node, 'value'))
-    e.attribute(boolean_node(node, 'isDefault'))
-    return e
+    return self.decode(node, enumvalue_tags)
+
+  def get_enumvalue_list(self, node):
+    return [self.get_enumvalue(node),]
 
   def get_enumvalues(self, node):
-    e = svd_object()
-    e.attribute(string_node(node, 'name'))
-    e.attribute(string_node(node, 'usage'))
-    e.list_attribute([self.get_enumvalue(x) for x in node.findall('.//enumeratedValue')], 'enumeratedValue')
+    e = self.decode(node, enumvalues_tags, enumvalues_lists)
     e.derivedFrom = node.get('derivedFrom')
     return e
 
+  def get_enumvalues_list(self, node):
+    return [self.get_enumvalues(node),]
+
   def get_field(self, node):
-    f = svd_object()
-    f.attribute(string_node(node, 'name'))
-    f.attribute(string_node(node, 'description'))
-    f.attribute(string_node(node, 'access'))
-    f.attribute(integer_node(node, 'bitOffset'))
-    f.attribute(integer_node(node, 'bitWidth'))
-    f.attribute(integer_node(node, 'lsb'))
-    f.attribute(integer_node(node, 'msb'))
-    f.attribute(string_node(node, 'bitRange'))
-    f.list_attribute([self.get_enumvalues(x) for x in node.findall('.//enumeratedValues')], 'enumeratedValues')
+    f = self.decode(node, field_tags, field_lists)
     f.derivedFrom = node.get('derivedFrom')
     # if an enumerated value set is "derivedFrom" another enumerated value set, add a derived_from reference
     set_derived_from(f.enumeratedValues, 'enumeratedValues')
     return f
 
+  def get_fields(self, node):
+    """return the fields within a fields element"""
+    return [self.get_field(x) for x in node if x.tag == 'field']
+
   def get_register(self, node):
-    r = svd_object()
-    r.attribute(integer_node(node, 'dim'))
-    r.attribute(integer_node(node, 'dimIncrement'))
-    r.attribute(string_node(node, 'dimIndex'))
-    r.attribute(string_node(node, 'name'))
-    r.attribute(string_node(node, 'displayName'))
-    r.attribute(string_node(node, 'description'))
-    r.attribute(string_node(node, 'alternateGroup'))
-    r.attribute(string_node(node, 'alternateRegister'))
-    r.attribute(integer_node(node, 'addressOffset'))
-    r.attribute(integer_node(node, 'size'))
-    r.attribute(string_node(node, 'access'))
-    r.attribute(string_node(node, 'protection'))
-    r.attribute(integer_node(node, 'resetValue'))
-    r.attribute(integer_node(node, 'resetMask'))
-    r.attribute(string_node(node, 'dataType'))
-    r.attribute(integer_node(node, 'resetMask'))
-    r.attribute(string_node(node, 'modifiedWriteValues'))
-    #<xs:element name="writeConstraint" type="writeConstraintType" minOccurs="0"/>
-    r.attribute(string_node(node, 'readAction'))
-    r.list_attribute([self.get_field(x) for x in node.findall('.//field')], 'fields')
+    r = self.decode(node, register_tags, register_lists)
     r.derivedFrom = node.get('derivedFrom')
     # if a field is "derivedFrom" another field, add a derived_from reference
     set_derived_from(r.fields, 'field')
     return r
 
+  def get_registers(self, node):
+    """return the registers within a registers or cluster element"""
+    l = []
+    for x in node:
+      if x.tag == 'register':
+        l.append(self.get_register(x))
+      elif x.tag == 'cluster':
+        # clusters are flattened, the registers are added in document order
+        l.extend(self.get_registers(x))
+    return l
+
   def get_address_block(self, node):
-    b = svd_object()
-    b.attribute(integer_node(node, 'offset'))
-    b.attribute(integer_node(node, 'size'))
-    b.attribute(string_node(node, 'usage'))
-    return b
+    return self.decode(node, address_block_tags)
+
+  def get_address_block_list(self, node):
+    return [self.get_address_block(node),]
 
   def get_interrupt(self, node):
-    i = svd_object()
-    i.attribute(string_node(node, 'name'))
-    i.attribute(string_node(node, 'description'))
-    i.attribute(integer_node(node, 'value'))
-    return i
+    return self.decode(node, interrupt_tags)
+
+  def get_interrupt_list(self, node):
+    return [self.get_interrupt(node),]
 
   def get_peripheral(self, node):
-    p = svd_object()
-    p.attribute(string_node(node, 'name'))
-    p.attribute(string_node(node, 'version'))
-    p.attribute(string_node(node, 'description'))
-    p.attribute(string_node(node, 'alternatePeripheral'))
-    p.attribute(string_node(node, 'groupName'))
-    p.attribute(string_node(node, 'prependToName'))
-    p.attribute(string_node(node, 'appendToName'))
-    p.attribute(string_node(node, 'headerStructName'))
-    p.attribute(string_node(node, 'disableCondition'))
-    p.attribute(integer_node(node, 'baseAddress'))
-    p.attribute(integer_node(node, 'size')) # default register size
-    p.list_attribute([self.get_address_block(x) for x in node.findall('./addressBlock')], 'addressBlock')
-    p.list_attribute([self.get_interrupt(x) for x in node.findall('./interrupt')], 'interrupts')
-    p.list_attribute([self.get_register(x) for x in node.findall('.//register')], 'registers')
+    p = self.decode(node, peripheral_tags, peripheral_lists)
     p.derivedFrom = node.get('derivedFrom')
     # if a register is "derivedFrom" another register, add a derived_from reference
     set_derived_from(p.registers, 'register')
     return p
 
+  def get_peripherals(self, node):
+    """return the peripherals within a peripherals element"""
+    return [self.get_peripheral(x) for x in node if x.tag == 'peripheral']
+
   def get_cpu(self, node):
-    c = svd_object()
-    c.attribute(string_node(node, 'name'))
-    c.attribute(string_node(node, 'revision'))
-    c.attribute(string_node(node, 'endian'))
-    c.attribute(boolean_node(node, 'mpuPresent'))
-    c.attribute(boolean_node(node, 'fpuPresent'))
-    c.attribute(boolean_node(node, 'fpuDP'))
-    c.attribute(boolean_node(node, 'icachePresent'))
-    c.attribute(boolean_node(node, 'dcachePresent'))
-    c.attribute(boolean_node(node, 'itcmPresent'))
-    c.attribute(boolean_node(node, 'dtcmPresent'))
-    c.attribute(boolean_node(node, 'vtorPresent'))
-    c.attribute(integer_node(node, 'nvicPrioBits'))
-    c.attribute(boolean_node(node, 'vendorSystickConfig'))
-    c.attribute(integer_node(node, 'deviceNumInterrupts'))
-    c.attribute(integer_node(node, 'sauNumRegions'))
-    #<xs:element name="sauRegionsConfig" minOccurs="0">
-    return c
+    if node is None:
+      return svd_object()
+    return self.decode(node, cpu_tags)
+
+  def get_device_header(self, node):
+    """return the device described by the svd file (no peripherals)"""
+    d = self.decode(node, device_tags)
+    d.cpu = self.get_cpu(node.find('cpu'))
+    return d
 
   def get_device(self, node):
     """return the device described by the svd file"""
-    d = svd_object()
-    d.attribute(string_node(node, 'vendor'))
-    d.attribute(string_node(node, 'vendorID'))
-    d.attribute(string_node(node, 'name'))
-    d.attribute(string_node(node, 'series'))
-    d.attribute(string_node(node, 'version'))
-    d.attribute(string_node(node, 'description'))
-    d.attribute(string_node(node, 'licenseText'))
-    d.cpu = self.get_cpu(node.find('./cpu'))
-    d.attribute(string_node(node, 'headerSystemFilename'))
-    d.attribute(string_node(node, 'headerDefinitionsPrefix'))
-    d.attribute(integer_node(node, 'addressUnitBits'))
-    d.attribute(integer_node(node, 'width'))
-    d.list_attribute([self.get_peripheral(x) for x in self.root.findall('.//peripheral')], 'peripherals')
+    d = self.decode(node, device_tags, device_lists)
+    d.cpu = self.get_cpu(node.find('cpu'))
     # if a peripheral is "derivedFrom" another peripheral, add a derived_from reference
     set_derived_from(d.peripherals, 'peripheral')
+    self.report_unresolved(resolve_derived_from(d.peripherals))
     return d
 
   def parse(self):
     return self.get_device(self.root)
 
 # -----------------------------------------------------------------------------
+
+class lazy_parser(parser):
+  """
+  Parse the svd file, but only decode the registers of a peripheral when
+  they are asked for (see peripheral_registers). The peripheral headers are
+  decoded up front. Derived peripherals without registers of their own share
+  the decoded registers of the base peripheral.
+  A dotted derivedFrom reference to another peripheral (E.g. PERIPH.REG.FIELD)
+  decodes the registers of that peripheral first.
+  """
+
+  def __init__(self, path):
+    parser.__init__(self, path)
+    # registers xml node -> decoded registers
+    self.decoded = {}
+    # peripheral name -> peripheral
+    self.names = {}
+    # dotted path indexes for the decoded registers
+    self.paths = new_paths()
+
+  def get_peripherals(self, node):
+    """return the peripherals within a peripherals element"""
+    l = parser.get_peripherals(self, node)
+    self.names = dict([(p.name, p) for p in l])
+    return l
+
+  def get_peripheral(self, node):
+    p = self.decode(node, peripheral_tags, peripheral_header_lists)
+    p.derivedFrom = node.get('derivedFrom')
+    # a derived peripheral will inherit the registers node of the base
+    x = node.find('registers')
+    if x is not None:
+      p.registers_node = x
+    return p
+
+  def peripheral_registers(self, p):
+    """decode and return the registers for a peripheral"""
+    if p.__dict__.has_key('registers'):
+      return p.registers
+    node = p.registers_node
+    if node is None:
+      return None
+    regs = self.decoded.get(node)
+    if regs is None:
+      regs = self.get_registers(node)
+      # if a register is "derivedFrom" another register, add a derived_from reference
+      set_derived_from(regs, 'register')
+      self.decoded[node] = regs
+      p.list_attribute(regs, 'registers')
+      # decode the other peripherals named by dotted references
+      for (scope, x) in scoped_objects([p,]):
+        if scope and x.derivedFrom and x.derived_from is None:
+          base = self.names.get(x.derivedFrom.split('.')[0])
+          if base is not None and base is not p:
+            self.peripheral_registers(base)
+      self.report_unresolved(resolve_derived_from([p,], self.paths))
+    else:
+      p.list_attribute(regs, 'registers')
+      index_objects(scoped_objects([p,]), self.paths)
+    return p.registers
+
+# -----------------------------------------------------------------------------
+
+class stream_parser(parser):
+  """
+  Parse the svd file one peripheral at a time.
+  The xml for each peripheral is released once it has been parsed, so the
+  whole document tree is never held in memory.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    # the device header is available once all peripherals have been read
+    self.device = None
+    self.reported = set()
+
+  def open(self):
+    """open the svd file, it may be gzipped"""
+    if self.path.endswith('.gz'):
+      return gzip.open(self.path, 'rb')
+    return open(self.path, 'rb')
+
+  def generate(self, p, state, last):
+    """
+    Generate p and then the deferred peripherals derived from it.
+    Before the last pass, a peripheral with a dotted reference to a
+    peripheral that hasn't been seen yet is put back until the end.
+    """
+    (seen, deferred, later, paths) = state
+    ready = [p]
+    while ready:
+      p = ready.pop(0)
+      unresolved = resolve_derived_from([p,], paths)
+      if not last and [df for (path, df) in unresolved if '.' in df and not seen.has_key(df.split('.')[0])]:
+        later.append(p)
+        continue
+      self.report_unresolved(unresolved)
+      yield p
+      # the consumer is done with the registers
+      p.__dict__.pop('registers', None)
+      seen[p.name] = p
+      # any deferred peripherals derived from this one can now go
+      for x in deferred.pop(p.name, []):
+        x.derived_from = p
+        ready.append(x)
+
+  def peripherals(self):
+    """
+    Generate the peripherals in document order.
+    A peripheral derived from one that hasn't been seen yet is deferred
+    until that peripheral has been generated. Once the consumer has
+    processed a peripheral its registers are released. A derived
+    peripheral without registers of its own is left with no registers,
+    the consumer should copy them from the (already consumed) base.
+    The flattened objects of the consumed peripherals stay in a dotted path
+    index, so a reference to an earlier peripheral (E.g. PERIPH.REG.FIELD)
+    is resolved. A peripheral with a reference to a later one is deferred
+    until the end of the file.
+    """
+    # (seen, deferred, later, paths)
+    state = ({}, {}, [], new_paths())
+    (seen, deferred, later, paths) = state
+    f = self.open()
+    context = ET.iterparse(f, events=('end',), tag='peripheral')
+    for (event, node) in context:
+      p = self.get_peripheral(node)
+      # release the xml for this and any preceding peripherals
+      node.clear()
+      while node.getprevious() is not None:
+        del node.getparent()[0]
+      if p.derivedFrom:
+        if not seen.has_key(p.derivedFrom):
+          # forward reference: wait until we have the base peripheral
+          deferred.setdefault(p.derivedFrom, []).append(p)
+          continue
+        p.derived_from = seen[p.derivedFrom]
+      else:
+        p.derived_from = None
+      for x in self.generate(p, state, False):
+        yield x
+    # peripherals with dotted references to later peripherals
+    for p in later:
+      for x in self.generate(p, state, True):
+        yield x
+    # peripherals derived from a non-existent base
+    for l in deferred.values():
+      for p in l:
+        p.derived_from = None
+        self.report_unresolved(resolve_derived_from([p,], paths))
+        yield p
+    # the remaining tree is the device header
+    self.device = self.get_device_header(context.root)
+    f.close()
+
+# -----------------------------------------------------------------------------
@@ -0,0 +1,279 @@
+# -----------------------------------------------------------------------------
+"""
+
+SVD Index
+
+An index over all the vendor SVD files, used to find the devices with a given
+peripheral or register without parsing hundreds of SVD files.
+
+The index is a sorted text file, so it can be memory mapped and searched with
+a binary search. Each line is one of:
+
+D <device> <svd id>                       device name (from Contents.txt) -> svd
+K <peripheral>[.<register>] <svd ids>     peripheral/register name -> svds
+S <svd id> <sha1> <mtime> <size> <path>   svd id -> svd file
+
+The index is rebuilt incrementally. Only the SVD files that have changed since
+the last build are parsed again.
+
+"""
+# -----------------------------------------------------------------------------
+
+import os
+import re
+import glob
+import mmap
+import traceback
+
+import devcache
+
+# -----------------------------------------------------------------------------
+
+# Bump this when the index format, or the names taken from the svd files,
+# change. Other converter changes don't invalidate the index.
+INDEX_VERSION = 3
+
+# the index file
+index_file = os.path.join(devcache.cache_dir, 'svd.idx')
+
+# -----------------------------------------------------------------------------
+
+def svd_files():
+  """return all vendor svd files"""
+  files = glob.glob('vendor/*/svd/*.svd')
+  files.extend(glob.glob('vendor/*/svd/*.svd.gz'))
+  return sorted(files)
+
+def strip_svd(name):
+  """return a file name without its svd suffix (part names may have dots: LPC11Axxv0.6.svd.gz)"""
+  for suffix in ('.svd.gz', '.svd.xml', '.svd', '.xml'):
+    if name.endswith(suffix):
+      return name[:-len(suffix)]
+  return name
+
+def svd_name(path):
+  """return the svd name for a file: vendor/x/svd/y.svd.gz -> y"""
+  return strip_svd(os.path.basename(path))
+
+def index_version():
+  """return the version string for the index"""
+  return '%d' % INDEX_VERSION
+
+def file_stat(path):
+  """return the (mtime, size) for a file"""
+  st = os.stat(path)
+  return (int(st.st_mtime), st.st_size)
+
+def contents_devices():
+  """return a list of (device, svd path) from the vendor Contents.txt files"""
+  devices = []
+  for cfile in glob.glob('vendor/*/Contents.txt'):
+    svd_dir = os.path.join(os.path.dirname(cfile), 'svd')
+    f = open(cfile, 'r')
+    for l in f.readlines():
+      names = [x.strip() for x in l.strip().split(',')]
+      if len(names) < 2:
+        continue
+      name = strip_svd(names[-1])
+      for d in names[:-1]:
+        if d:
+          devices.append((d, os.path.join(svd_dir, name)))
+    f.close()
+  return devices
+
+# -----------------------------------------------------------------------------
+
+def svd_keys(path):
+  """return (path, keys, error) - the peripheral and register names in an svd file"""
+  # the svd converter is only imported when an svd file is indexed
+  import soc
+  try:
+    d = soc.build_device(path, stream=True)
+  except Exception:
+    # index the file without keys, it won't be parsed again until it changes
+    return (path, [], traceback.format_exc().strip().split('\n')[-1])
+  keys = []
+  for p in d.peripherals.values():
+    keys.append(p.name)
+    if p.registers:
+      keys.extend(['%s.%s' % (p.name, r.name) for r in p.registers.values()])
+  return (path, keys, None)
+
+# -----------------------------------------------------------------------------
+
+def _find_first(mm, s):
+  """return the offset of the first line >= s in a sorted buffer"""
+  lo = 0
+  hi = len(mm)
+  while lo < hi:
+    mid = (lo + hi) // 2
+    # the line containing mid
+    i = mm.rfind('\n', 0, mid) + 1
+    j = mm.find('\n', i)
+    if mm[i:j] < s:
+      lo = j + 1
+    else:
+      hi = i
+  return lo
+
+def glob_regex(pattern):
+  """return a regular expression for a glob pattern (* and ?) on a name"""
+  s = []
+  for c in pattern:
+    if c == '*':
+      s.append(r'\S*')
+    elif c == '?':
+      s.append(r'\S')
+    else:
+      s.append(re.escape(c))
+  return ''.join(s)
+
+def glob_prefix(pattern):
+  """return the literal prefix of a glob pattern"""
+  m = re.match(r'[^*?]*', pattern)
+  return m.group(0)
+
+class index(object):
+  """a memory mapped svd index"""
+
+  def __init__(self, path = index_file):
+    self.f = open(path, 'rb')
+    self.mm = mmap.mmap(self.f.fileno(), 0, access = mmap.ACCESS_READ)
+    self.version = self.mm[:self.mm.find('\n')].split()[-1]
+
+  def close(self):
+    self.mm.close()
+    self.f.close()
+
+  def lines(self, section, pattern):
+    """return a list of (name, value) for the section lines with names matching a glob pattern"""
+    prefix = '%s %s' % (section, glob_prefix(pattern))
+    # the lines starting with the literal prefix
+    start = _find_first(self.mm, prefix)
+    end = _find_first(self.mm, prefix + '\x7f')
+    regex = re.compile(r'^%s (%s) (.*)$' % (section, glob_regex(pattern)), re.M)
+    return [m.groups() for m in regex.finditer(self.mm, start, end)]
+
+  def svds(self):
+    """return a dictionary of svd id: (sha1, mtime, size, path)"""
+    svds = {}
+    for (svd_id, val) in self.lines('S', '*'):
+      (sha1, mtime, size, path) = val.split()
+      svds[svd_id] = (sha1, int(mtime), int(size), path)
+    return svds
+
+  def devices(self):
+    """return a dictionary of svd id: [device names]"""
+    devices = {}
+    for (name, svd_id) in self.lines('D', '*'):
+      devices.setdefault(svd_id, []).append(name)
+    return devices
+
+  def stale(self):
+    """return True if the index is out of date with the svd files"""
+    if self.version != index_version():
+      return True
+    svds = [(x[3], x[1], x[2]) for x in self.svds().values()]
+    files = [(path,) + file_stat(path) for path in svd_files()]
+    return sorted(svds) != files
+
+  def find(self, pattern):
+    """return a dictionary of svd path: (matched names, device names) for a glob pattern"""
+    matches = {}
+    for (name, svd_id) in self.lines('D', pattern):
+      matches.setdefault(svd_id, []).append(name)
+    for (name, ids) in self.lines('K', pattern):
+      for svd_id in ids.split(','):
+        matches.setdefault(svd_id, []).append(name)
+    svds = self.svds()
+    devices = self.devices()
+    result = {}
+    for (svd_id, names) in matches.items():
+      result[svds[svd_id][3]] = (names, devices.get(svd_id, []))
+    return result
+
+# -----------------------------------------------------------------------------
+
+def load_keys(path):
+  """return the version, svd file info and keys from an existing index"""
+  if not os.path.isfile(path):
+    return (None, {})
+  idx = index(path)
+  svds = idx.svds()
+  keys = {}
+  for (name, ids) in idx.lines('K', '*'):
+    for svd_id in ids.split(','):
+      keys.setdefault(svd_id, []).append(name)
+  version = idx.version
+  idx.close()
+  # path: (sha1, mtime, size, keys)
+  info = {}
+  for (svd_id, (sha1, mtime, size, svd_path)) in svds.items():
+    info[svd_path] = (sha1, mtime, size, keys.get(svd_id, []))
+  return (version, info)
+
+def update(path = index_file, force = False, pmap = map):
+  """
+  update the index for changed svd files, return [(path, error)] for the parsed files
+  pmap is the map function used to parse the svd files (E.g. a process pool map)
+  """
+  version = index_version()
+  (old_version, old) = load_keys(path)
+  if force or old_version != version:
+    old = {}
+  # work out which files need to be parsed
+  files = svd_files()
+  info = {}
+  todo = []
+  for svd_path in files:
+    (mtime, size) = file_stat(svd_path)
+    x = old.get(svd_path)
+    if x is not None and x[1:3] == (mtime, size):
+      info[svd_path] = x
+      continue
+    sha1 = devcache.file_hash(svd_path)
+    if x is not None and x[0] == sha1:
+      # touched, but not changed
+      info[svd_path] = (sha1, mtime, size, x[3])
+      continue
+    info[svd_path] = (sha1, mtime, size, None)
+    todo.append(svd_path)
+  results = []
+  for (svd_path, keys, err) in pmap(svd_keys, todo):
+    (sha1, mtime, size, _) = info[svd_path]
+    info[svd_path] = (sha1, mtime, size, keys)
+    results.append((svd_path, err))
+  # build the index lines
+  lines = []
+  ids = {}
+  inverted = {}
+  for (i, svd_path) in enumerate(files):
+    svd_id = '%04d' % i
+    ids[svd_path] = svd_id
+    (sha1, mtime, size, keys) = info[svd_path]
+    lines.append('S %s %s %d %d %s' % (svd_id, sha1, mtime, size, svd_path))
+    for k in keys:
+      inverted.setdefault(k, []).append(svd_id)
+    # the svd name is also a device name
+    lines.append('D %s %s' % (svd_name(svd_path), svd_id))
+  # svd paths by svd name in the vendor directory
+  names = dict([(os.path.join(os.path.dirname(x), svd_name(x)), x) for x in files])
+  for (d, svd) in contents_devices():
+    if names.has_key(svd) and d != svd_name(names[svd]):
+      lines.append('D %s %s' % (d, ids[names[svd]]))
+  for (k, svd_ids) in inverted.iteritems():
+    lines.append('K %s %s' % (k, ','.join(sorted(set(svd_ids)))))
+  lines = sorted(set(lines))
+  lines.insert(0, '# pycs svd index %s' % version)
+  # write to a temporary file and rename, so a partial index is never used
+  if not os.path.isdir(os.path.dirname(path)):
+    os.makedirs(os.path.dirname(path))
+  tmp = '%s.tmp%d' % (path, os.getpid())
+  f = open(tmp, 'wb')
+  f.write('\n'.join(lines))
+  f.write('\n')
+  f.close()
+  os.rename(tmp, path)
+  return results
+
+# -----------------------------------------------------------------------------
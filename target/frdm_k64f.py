@@ -56,6 +56,7 @@ class target(object):
       ('mem', self.mem.menu, 'memory functions'),
       ('regs', self.cmd_regs, soc.help_regs),
       ('vtable', self.cpu.cmd_vtable),
+      ('watch', self.device.cmd_watch, soc.help_watch),
     )
 
     self.ui.cli.set_root(self.menu_root)
@@ -105,6 +105,7 @@ class target(object):
       ('program', self.flash.cmd_program, flash.help_program),
       ('regs', self.cmd_regs, soc.help_regs),
       ('vtable', self.cpu.cmd_vtable),
+      ('watch', self.device.cmd_watch, soc.help_watch),
     )
 
     self.ui.cli.set_root(self.menu_root)
@@ -172,6 +172,7 @@ class target(object):
       ('regs', self.cmd_regs, soc.help_regs),
       ('rtt', self.rtt.menu, 'rtt client functions'),
       ('vtable', self.cpu.cmd_vtable),
+      ('watch', self.device.cmd_watch, soc.help_watch),
     )
 
     self.ui.cli.set_root(self.menu_root)
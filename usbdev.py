@@ -5,9 +5,18 @@ USB Device
 
 A generic class for reading/writing USB devices.
 
+Reads are normally synchronous: the usb read is started when the caller asks
+for data. With the reader thread started (start_reader) a usb read is always
+in flight, into a small pool of buffers, so a device reply is taken as soon as
+it is ready and the caller can have several commands in flight.
+
 """
 #------------------------------------------------------------------------------
 
+import time
+import errno
+import Queue
+import threading
 import usb.core
 from array import array as Array
 from usbtools.usbtools import UsbTools
@@ -46,6 +55,11 @@ def find(vps, sn = None):
   # 1 device
   return devices[0], None
 
+def buffer_view(data, ofs, size):
+  """return a read-only buffer of size bytes at ofs in an array/str/bytearray"""
+  # pyusb copies a non-array buffer into an array, this avoids a second copy
+  return buffer(data, ofs, size)
+
 #------------------------------------------------------------------------------
 
 class usbdev_error(IOError):
@@ -58,10 +72,16 @@ class usbdev(object):
     self.usb_dev = None
     self.usb_rd_timeout = 5000
     self.usb_wr_timeout = 5000
-    self.rdbuf = Array('B')
-    self.rdofs = 0
     self.rdbuf_chunksize = 4 << 10
     self.wrbuf_chunksize = 4 << 10
+    # usb reads go into this buffer, data is in rdbuf[rdofs:rdlen]
+    self.rdbuf = Array('B', '\x00' * self.rdbuf_chunksize)
+    self.rdofs = 0
+    self.rdlen = 0
+    # reader thread
+    self.reader = None
+    self.reader_timeout = 1000
+    self.read_into_api = False
     self.itf = None
     self.index = None
     self.ep_in = None
@@ -81,12 +101,45 @@ class usbdev(object):
 
   def close(self):
     """close the interface"""
+    self.stop_reader()
     UsbTools.release_device(self.usb_dev)
 
+  def start_reader(self, nbufs = 4):
+    """start a thread that keeps a usb read in flight, return True if started"""
+    if not self.read_into_api:
+      # the thread needs pyusb reads into a buffer
+      return False
+    if self.reader is not None:
+      return True
+    self.rd_free = Queue.Queue()
+    self.rd_full = Queue.Queue()
+    for i in xrange(nbufs):
+      self.rd_free.put(Array('B', '\x00' * self.rdbuf_chunksize))
+    # the buffer being consumed by read_into
+    self.rd_current = None
+    # the time read_into started waiting for the reader thread
+    self.rd_waiting = None
+    self.reader_stop = False
+    self.reader = threading.Thread(target = self._reader)
+    self.reader.daemon = True
+    self.reader.start()
+    self._read = self._read_queue
+    return True
+
+  def stop_reader(self):
+    """stop the reader thread"""
+    if self.reader is None:
+      return
+    self.reader_stop = True
+    self.reader.join()
+    self.reader = None
+    self._read = self._read_into
+
   def write_data(self, data):
-    """write a data buffer to the device"""
+    """write a data buffer (array, str or bytearray) to the device"""
     ofs = 0
-    size = len(data)
+    # size in bytes
+    size = len(data) * getattr(data, 'itemsize', 1)
     try:
       while ofs < size:
         # how many bytes should we write?
@@ -94,8 +147,11 @@ class usbdev(object):
         if wr_size > size - ofs:
           # reduce the write size
           wr_size = size - ofs
-        # write the bytes
-        n = self._write(data[ofs : ofs + wr_size])
+        # write the bytes, a buffer that fits a chunk is passed through whole
+        if wr_size == size:
+          n = self._write(data)
+        else:
+          n = self._write(buffer_view(data, ofs, wr_size))
         if n <= 0:
           raise usbdev_error("USB bulk write error")
         ofs += n
@@ -104,52 +160,37 @@ class usbdev(object):
     except usb.core.USBError, e:
       raise usbdev_error(str(e))
 
-  def read_data(self, size, attempts = 1):
-    """read size bytes of data from the device"""
-    data = Array('B')
-    # do we have all of the data in the read buffer?
-    if size <= len(self.rdbuf) - self.rdofs:
-      data = self.rdbuf[self.rdofs : self.rdofs + size]
-      self.rdofs += size
-      return data
-    # do we have some of the data in the read buffer?
-    if len(self.rdbuf) - self.rdofs > 0:
-      data = self.rdbuf[self.rdofs:]
-      # do a usb read to get the rest...
-    # read from the usb device
+  def read_into(self, buf, size = None):
+    """read size (default: len(buf)) bytes into a bytearray/memoryview, return size"""
+    if size is None:
+      size = len(buf)
+    ofs = 0
     try:
-      bytes_to_rd = size - len(data)
-      while bytes_to_rd > 0:
-        # read from the usb device
-        while True:
-          self.rdbuf = self._read()
+      while ofs < size:
+        n = self.rdlen - self.rdofs
+        if n == 0:
+          # read from the usb device, no data received: read again
+          n = self._read()
           self.rdofs = 0
-          if len(self.rdbuf) > 0:
-            break
-          else:
-            # no data received
-            attempts -= 1
-            if attempts > 0:
-              # try again
-              continue
-              # return what we have
-              return data
-        # copy the read buffer into the returned data
-        n = len(self.rdbuf)
-        if n >= bytes_to_rd:
-          # copy a partial read buffer
-          data += self.rdbuf[:bytes_to_rd]
-          self.rdofs = bytes_to_rd
-          return data
-        else:
-          # copy all of the read buffer
-          data += self.rdbuf
-          bytes_to_rd -= n
-          # read more data...
+          self.rdlen = n
+          continue
+        if n > size - ofs:
+          n = size - ofs
+        # copy from the read buffer
+        buf[ofs : ofs + n] = buffer(self.rdbuf, self.rdofs, n)
+        self.rdofs += n
+        ofs += n
+      return size
     except usb.core.USBError, e:
       raise usbdev_error(str(e))
-    # never reached
-    raise usbdev_error("internal error")
+
+  def read_data(self, size):
+    """read size bytes of data from the device, return a byte array"""
+    buf = bytearray(size)
+    self.read_into(buf)
+    data = Array('B')
+    data.fromstring(buffer(buf))
+    return data
 
   # private functions
 
@@ -163,6 +204,10 @@ class usbdev(object):
       usb_api = 2
     for m in ('write', 'read'):
       setattr(self, '_%s' % m, getattr(self, '_%s_v%d' % (m, usb_api)))
+    if (len(args) > 2) and (args[2] == 'size_or_buffer'):
+      # pyusb >= 1.0.0 can read into the read buffer
+      self.read_into_api = True
+      self._read = self._read_into
 
   def _set_interface(self, config, ifnum):
     """select the interface to use"""
@@ -181,7 +226,8 @@ class usbdev(object):
 
   def _read_v1(self):
     """Read using the deprecated API"""
-    return self.usb_dev.read(self.ep_in, self.rdbuf_chunksize, self.interface, self.usb_rd_timeout)
+    self.rdbuf = self.usb_dev.read(self.ep_in, self.rdbuf_chunksize, self.interface, self.usb_rd_timeout)
+    return len(self.rdbuf)
 
   def _write_v2(self, data):
     """Write using the API introduced with pyusb 1.0.0b2"""
@@ -189,7 +235,67 @@ class usbdev(object):
 
   def _read_v2(self):
     """Read using the API introduced with pyusb 1.0.0b2"""
-    return self.usb_dev.read(self.ep_in, self.rdbuf_chunksize, self.usb_rd_timeout)
+    self.rdbuf = self.usb_dev.read(self.ep_in, self.rdbuf_chunksize, self.usb_rd_timeout)
+    return len(self.rdbuf)
+
+  def _read_into(self):
+    """Read into the read buffer (pyusb >= 1.0.0)"""
+    return self.usb_dev.read(self.ep_in, self.rdbuf, self.usb_rd_timeout)
+
+  def _read_queue(self):
+    """Read the next buffer from the reader thread"""
+    if self.rd_current is not None:
+      # the last buffer has been consumed
+      self.rd_free.put(self.rd_current)
+      self.rd_current = None
+    # python 2 timed waits poll, so the reader thread reports the timeout
+    # and any failure (the wait is bounded by usb_rd_timeout)
+    self.rd_waiting = time.time()
+    (buf, n) = self.rd_full.get()
+    self.rd_waiting = None
+    if buf is None:
+      if self.reader_stop:
+        # the reader thread failed
+        self.reader.join()
+        self.reader = None
+        self._read = self._read_into
+      raise n
+    self.rd_current = buf
+    self.rdbuf = buf
+    return n
+
+  def _reader(self):
+    """reader thread: usb reads into the free buffers, queue the full buffers"""
+    while not self.reader_stop:
+      try:
+        buf = self.rd_free.get(True, self.reader_timeout / 1000.0)
+      except Queue.Empty:
+        # all buffers are waiting to be consumed
+        continue
+      try:
+        # a short timeout, so the stop flag is seen
+        n = self.usb_dev.read(self.ep_in, buf, self.reader_timeout)
+      except usb.core.USBError, e:
+        self.rd_free.put(buf)
+        if getattr(e, 'errno', None) == errno.ETIMEDOUT:
+          # no data, has read_into been waiting too long?
+          t = self.rd_waiting
+          if t is not None and time.time() - t > self.usb_rd_timeout / 1000.0:
+            self.rd_waiting = None
+            self.rd_full.put((None, usbdev_error('USB read timeout')))
+          continue
+        self.reader_stop = True
+        self.rd_full.put((None, e))
+        return
+      except Exception, e:
+        # any other failure is also passed on, read_into must not wait forever
+        self.reader_stop = True
+        self.rd_full.put((None, usbdev_error('USB reader thread failed: %s' % e)))
+        return
+      if n == 0:
+        self.rd_free.put(buf)
+        continue
+      self.rd_full.put((buf, n))
 
 #------------------------------------------------------------------------------
 